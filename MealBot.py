@@ -20,6 +20,9 @@
 # --custom-groupings:
 #   Use custom groupings instead of random groupings. This will prompt you to enter the custom groupings from a file.
 #   The file should contain a list of comma-separated names of students in each group, with each group on a new line.
+#   Emails can be used instead of names (e.g. for students who share a name). Every line is checked against the roster
+#   and all of the errors (unknown or ambiguous names, students in more than one group or in no group, groups of the
+#   wrong size) are reported together.
 #   EX. Alice, Bob, Charlie
 #       David, Eve
 #       Grace, Henry
@@ -29,6 +32,66 @@
 #   group of weeks that MealBot sends out groupings (i.e. every 1 week, 2 weeks, 3 weeks, etc).
 # --week-group-frequency:
 #   Frequency of week groups (1-52). Defaults to 2 (i.e. every other week).
+# --min-cost:
+#   Weigh previous groups by how many times and how recently (by week) each pair was grouped and find the groupings
+#   with the lowest total weight. Once most pairs have been used, leftover students get their least recent partners
+#   instead of being grouped randomly.
+# --year-weight, --college-weight:
+#   Prefer groups of students from different years or colleges. Each pair in the same year costs --year-weight and
+#   each pair in the same college costs --college-weight, on top of 1 for every time the pair was grouped before, in
+#   --min-cost and in groups of more than 2. Weights below 1 only choose between groups that are equally new; larger
+#   weights can trade a new pair for a more mixed one. Otherwise, groups of 2 still get the most new pairs possible,
+#   and each student is first offered their most diverse new partners.
+# --send-workers, --send-rate:
+#   Emails are sent from a pool of --send-workers threads, limited to an average of --send-rate emails per second.
+#   Rate limit and server errors are retried with exponential backoff, and a report of any groups that could not be
+#   emailed is printed at the end.
+# --batch-size:
+#   Number of emails to pack into each Gmail batch request (at most 100). Only failed emails are retried in later
+#   batches. Set to 0 to send each email in its own request from the --send-workers thread pool instead.
+# --yes, --dry-run:
+#   --yes answers yes to every prompt, except that when some emails fail to send it keeps the outbox to retry them on
+#   the next run instead of saving the groups (unless --save-on-failure). --dry-run gets the students and finds the
+#   groups, but doesn't send any emails or save the groups, so it doesn't prompt either.
+# --cohorts:
+#   Run several cohorts (e.g. one per club or residential college) without prompts, each in its own process, and print
+#   one combined summary at the end. Takes a JSON file with a list of cohort configs:
+#   EX. [{"name": "Davenport", "ids": {"SIGNUP_FORM_ID": "...", "GROUPS_SHEET_ID": "..."},
+#         "message_file": "davenport.txt", "exclude_file": "davenport_exclude.txt", "week_group_frequency": 1}]
+#   Each cohort's output is written to logs/<name>.log.
+# --exclude-file:
+#   Students to leave out, one per line: an email, a whole domain (*@example.edu) or every subdomain of a domain
+#   (*@*.example.edu). Lines starting with # are comments. Emails are compared case-insensitively.
+# --refresh-responses:
+#   Form responses are cached in responses_cache/ and only responses submitted or edited since the last run are
+#   downloaded. Use this to download every response again (e.g. after deleting responses from the form).
+# --resync-groups:
+#   Previous groups are mirrored in groups.db and only rows added to the sheet since the last run are downloaded. Use
+#   this to download every row again (e.g. after editing old rows in the sheet by hand).
+# --schedule:
+#   Pair students from a precomputed season of rounds (a round-robin, so no pair repeats within the season), stored in
+#   schedules/<GroupsSheetID>.json with a cursor to the next round. Students who leave or join only change the pairs
+#   they were (or will be) in. A new season is made when the schedule is used up; delete the file to start over.
+# --shards, --shard-by:
+#   For very large rosters, split the roster into --shards shards (randomly, by a hash of each email, or by college),
+#   group each shard in parallel worker processes using only the history inside it, and then group the students each
+#   shard couldn't place (odd students and repeats) together in a final pass. Only the pairs that have met are kept
+#   for the whole roster, so memory grows with the history instead of n * n. Starting the worker processes costs
+#   more than it saves below about 10,000 students. The new-pair ratio is printed; use
+#   `python bench.py --shards 1 4 8` to compare it with the unsharded result and pick the number of shards.
+# --repair:
+#   Fix up the last round after students drop out (opt out on the form or are added to the exclude file) or sign up
+#   late. Only the members of groups that lost someone and the new students are re-grouped, preferring students who
+#   have never met, and only the changed groups are emailed and saved. Unaffected groups are left alone.
+# --metrics:
+#   Time each phase of the run (nested), each Google API call (latency, retries and errors), and the grouping (candidate
+#   pairs, filtered pairs, iterations), and write the metrics as JSON to the given file, or print a summary with '-'.
+# --group-size:
+#   Number of students in each group. Defaults to 2. Larger groups are found with a local search that swaps students
+#   between groups to minimize the number of pairs that have been grouped before, for up to --time-budget seconds.
+#   When the group size doesn't divide the number of students, the groups are made as even as possible without going
+#   over the group size, so some have one student fewer (or more than one fewer when there are very few students, e.g.
+#   5 students in groups of 4 makes groups of 3 and 2).
 # --message-file:
 #   A file with the body of the email you want sent out to each group. The string
 #   '{GroupList}' should appear exactly once in this file; in the sent emails, '{GroupList}'
@@ -36,20 +99,29 @@
 
 import random
 import argparse
-import httplib2
-import itertools
 from math import floor
-from tqdm import tqdm
 from datetime import date, timedelta
-from httplib2 import Http
 from oauth2client import client, tools, file
 import base64
 from email.message import EmailMessage
-from apiclient import errors, discovery
+from apiclient import errors
 import json
-import re
 
 from utils import *
+import metrics
+from matching import maxMatching, localSearchGroups
+from costs import buildCostMatrix, minCostPairs, encodeDiversity, addDiversityCost, diversePairCost, diverseOrder, diverseGreedyMatch, YEAR_WEIGHT, COLLEGE_WEIGHT
+from history import buildPairIndex, normalizeEmail, HistoryLookup
+from customgroupings import validateCustomGroupings
+from schedule import scheduleFile, loadSchedule, saveSchedule, buildSchedule, updateSchedule, nextRound, advance, roundsLeft
+from roster import fetchResponses, buildRoster, parseExcludeRules
+from store import GroupStore, GROUPS_DB
+from services import getService
+from pipeline import getCohorts, runCohorts
+from mailer import sendMessages, SEND_WORKERS, SEND_RATE, BATCH_SIZE
+from outbox import Outbox, outboxFile
+from repair import repairGroups
+from shards import shardedGroups, SHARD_BY
 
 CREDENTIALS_FILE    = 'client_secret.json'
 TOKEN_FILE          = 'token.json'
@@ -58,7 +130,7 @@ EXCLUDE_FILE        = 'exclude.txt'
 SCOPES              = ['https://www.googleapis.com/auth/gmail.send', 'https://www.googleapis.com/auth/forms.responses.readonly', 'https://www.googleapis.com/auth/spreadsheets']
 DISCOVERY_DOC       = 'https://forms.googleapis.com/$discovery/rest?version=v1'
 GROUP_SIZE          = 2
-GROUPS_RANGE        = 'Sheet1!A2:B'
+TIME_BUDGET         = 5.0
 
 # Defaults - can be overridden with arguments.
 DEFAULT_MESSAGE_FILE        = 'message.txt'
@@ -79,30 +151,12 @@ class Student:
             print(d)
             raise
 
-# Function to generate all possible combinations of k-groups from a list of students
-def generate_combinations(students):
-    print('Generating all possible combinations...', end='')
-    combinations = list(itertools.combinations(students, GROUP_SIZE))
-    print('Done')
-    return combinations
-
-# Function to filter out combinations that have been used before
-def filter_combinations(combinations, prevGroups):
-    print('Filtering out previously used combinations...', end='')
-    new_groups = []
-    prevGroups = set([grp[1] for grp in prevGroups])
-    for grp in combinations:
-        if frozenset([student.name for student in grp]) not in prevGroups:
-            new_groups.append(grp)
-    print('Done')
-    return new_groups
-
 # Breaks the list l into chunks of size n. Assume that len(l) % n == 0.
 # Returns a list of lists.
 # EX. l = [0, 1, 2, 3]; n = 2. Returns [[0, 1], [2, 3]]
-def chunk(l):
+def chunk(l, n=GROUP_SIZE):
     # First break into chunks. Groups is a list of list of Students
-    n = max(1, GROUP_SIZE)
+    n = max(1, n)
     groups = [l[i:i + n] for i in range(0, len(l), n)]
     return groups
 
@@ -114,7 +168,7 @@ def print_header(header, length):
         print('\n{} [{}]:'.format(header, length))
 
 def print_groups(header, groups, student=True, emails=False):
-    last_week_group = None if student else groups[-1][0]
+    last_week_group = None if student or len(groups) == 0 else groups[-1][0]
     print_header(header, len(groups))
 
     week_group = None
@@ -123,7 +177,7 @@ def print_groups(header, groups, student=True, emails=False):
 
     for grp in groups:
         if not student:
-            week, group = grp
+            week, group = grp[0], grp[1]
             if week != week_group:
                 if week_group_count > 0:
                     print('{}'.format(week_group_count))
@@ -148,6 +202,14 @@ def print_students(header, students):
     for student in students:
         print('\t{}'.format(student.name))
 
+# Prints how many groups mix students from more than one year and from more than one college
+def print_mixing(groups):
+    years = sum([1 for grp in groups if len(set([student.year for student in grp])) > 1])
+    colleges = sum([1 for grp in groups if len(set([student.college for student in grp])) > 1])
+    print('\nGroups mixing years: {}/{}'.format(years, len(groups)))
+    print('Groups mixing colleges: {}/{}'.format(colleges, len(groups)))
+
+@metrics.timed
 def getIds(filename):
     print('Reading ids file...', end='')
     with open(filename, 'r') as idsFile:
@@ -155,6 +217,7 @@ def getIds(filename):
     print('Done')
     return ids
 
+@metrics.timed
 def getMessage(messageFilename):
     print('Reading message file...', end='')
     messageFile = open(messageFilename, 'r')
@@ -163,6 +226,7 @@ def getMessage(messageFilename):
     print('Done')
     return message
 
+@metrics.timed
 def getCredentials(credentialFilename, tokenFilename, user_agent):
     print('Getting credentials...', end='')
     store = file.Storage(tokenFilename)
@@ -175,106 +239,89 @@ def getCredentials(credentialFilename, tokenFilename, user_agent):
     print('Done')
     return credentials
 
-def getStudents(credentials, ids):
+# Gets every response to the signup form. Runs alongside the other startup fetches, so it only prints whole lines.
+@metrics.timed
+def getResponses(credentials, ids, refresh=False):
+    service = getService('forms', 'v1', credentials, discoveryServiceUrl=DISCOVERY_DOC, static_discovery=False)
+    responses, numFetched = fetchResponses(service, ids["SIGNUP_FORM_ID"], refresh=refresh)
+    print('Getting form responses...Done ({} responses, {} new or edited)'.format(len(responses), numFetched))
+    return responses
+
+@metrics.timed
+def getStudents(responses, ids, rules=None):
     print('Getting students...', end='')
-    students, opted_out = [], []
-    service = discovery.build('forms', 'v1', http=credentials.authorize(Http()), discoveryServiceUrl=DISCOVERY_DOC, static_discovery=False)
-    result = service.forms().responses().list(formId=ids["SIGNUP_FORM_ID"]).execute()
-    for response in result['responses']:
-        if ids["OPT_IN_QID"] in response['answers'].keys():
-            opt_in = response['answers'][ids["OPT_IN_QID"]]['textAnswers']['answers'][0]['value']
-            if opt_in == ids["OPT_IN_NO"]:
-                opted_out.append(response['respondentEmail'].strip())
-                continue
-        students.append(Student({
-            'firstname': response['answers'][ids["FIRST_NAME_QID"]]['textAnswers']['answers'][0]['value'].strip(),
-            'lastname': response['answers'][ids["LAST_NAME_QID"]]['textAnswers']['answers'][0]['value'].strip(),
-            'year': response['answers'][ids["YEAR_QID"]]['textAnswers']['answers'][0]['value'],
-            'college': response['answers'][ids["COLLEGE_QID"]]['textAnswers']['answers'][0]['value'],
-            'email': response['respondentEmail'].strip()
-        }))
-    print('Done ({} opted in, {} opted out)'.format(len(students), len(opted_out)))
+    entries, drops = buildRoster(responses, ids, rules)
+    students = [Student(entry) for entry in entries]
+    print('Done ({} students)'.format(len(students)))
+    print_drops(drops)
     return students
 
-def excludeStudents(students):
-    with open(EXCLUDE_FILE, 'r') as f:
-        lines = f.read().splitlines()
-    # Check to see if line matches email format
-    excluded_emails, invalid_lines = [], []
-    for line in lines:
-        if re.match(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$', line):
-            excluded_emails.append(line)
-        else:
-            invalid_lines.append(line)
+# Prints how many responses each stage of the roster pipeline dropped
+def print_drops(drops):
+    reasons = [('incomplete', 'missing an email or answer'), ('invalid_email', 'with an invalid email'),
+               ('duplicate', 'older responses from the same email'), ('opted_out', 'opted out'),
+               ('excluded', 'excluded')]
+    for stage, reason in reasons:
+        if drops.get(stage, 0) > 0:
+            print('\tDropped {} ({})'.format(drops[stage], reason))
+
+# Reads the emails and domains of students to leave out from excludeFile. Each line is an email, a domain
+# ('*@example.edu') or every subdomain of a domain ('*@*.example.edu').
+@metrics.timed
+def getExcludeRules(excludeFile=EXCLUDE_FILE):
+    with open(excludeFile, 'r') as f:
+        rules, invalid_lines = parseExcludeRules(f)
     for invalid_line in invalid_lines:
-        print('=== Warning: Invalid line in {} (not an email): {} ==='.format(EXCLUDE_FILE, invalid_line))
-    if len(excluded_emails) == 0:
-        return students
-    # Exclude students with emails in the excluded list
-    print('Excluding {} student{}...'.format(len(excluded_emails), ('' if len(excluded_emails) == 1 else 's')), end='')
-    students = [student for student in students if student.email not in excluded_emails]
-    print('Done')
-    return students
+        print('=== Warning: Invalid line in {} (not an email or domain): {} ==='.format(excludeFile, invalid_line.strip()))
+    return rules
 
-def getPrevGroups(credentials, spreadsheetId, range):
-    print('\nGetting previous groups...', end='')
+@metrics.timed
+def getPrevGroups(credentials, spreadsheetId, store, resync=False):
     prevGroups = []
     sheet = None
     try:
-        service = discovery.build('sheets', 'v4', credentials=credentials)
+        service = getService('sheets', 'v4', credentials)
         sheet = service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=spreadsheetId, range=range).execute()
-        values = result.get('values', [])
-        for row in values:
-            # Pack into tuple (week, set of students in group)
-            prevGroups.append([row[0], frozenset(row[1].split(', '))])
-        print('Done')
+        if resync:
+            store.reset(spreadsheetId)
+        # Only download the rows added since the last run
+        numNew = store.sync(sheet, spreadsheetId)
+        prevGroups = store.rows(spreadsheetId)
+        print('Getting previous groups...Done ({} new rows)'.format(numNew))
     except errors.HttpError as error:
-        print('Failed')
+        print('Getting previous groups...Failed')
         print('Error: %s' % error)
+        sheet = None
     return prevGroups, sheet
 
-def findGroups(students, prevGroups, customGroupings):
+@metrics.timed
+def findGroups(students, prevGroups, customGroupings, groupSize=GROUP_SIZE, timeBudget=TIME_BUDGET, minCost=False, pairCounts=None, schedule=None,
+               yearWeight=YEAR_WEIGHT, collegeWeight=COLLEGE_WEIGHT, shards=1, shardBy='random', history=None):
     groups = []
 
     if customGroupings:
-        numGroups = floor(len(students)/GROUP_SIZE)
-        odd = True if len(students) % GROUP_SIZE == 1 else False
+        numGroups = floor(len(students)/groupSize)
+        odd = True if len(students) % groupSize == 1 else False
         if odd:
-            print('\nYou will need to enter {} groups of {} students each and 1 group of {} students.'.format(numGroups-1, GROUP_SIZE, GROUP_SIZE+1))
+            print('\nYou will need to enter {} groups of {} students each and 1 group of {} students.'.format(numGroups-1, groupSize, groupSize+1))
         else:
-            print('\nYou will need to enter {} groups of {} students each.'.format(numGroups, GROUP_SIZE))
-
-        # Get custom groupings from file
-        customGroupingsFile = open(input('\nWhich custom groupings file would you like to use?\n > '), 'r')
-        customGroupings = customGroupingsFile.read().splitlines()
-        customGroupingsFile.close()
-
-        while (len(customGroupings) > 0):
-            # Get next group
-            group = customGroupings.pop(0).split(', ')
-            group = [name.strip() for name in group]
-            group = [student for student in students if student.name in group]
-            if len(group) < GROUP_SIZE:
-                print('Error: You must have at least {} students in a group.'.format(GROUP_SIZE))
-                continue
-            if group[0].name == group[1].name:
-                print('Error: You cannot have the same student in a group twice.')
-                continue
-            for g in groups:
-                if len(set(g).intersection(set(group))) > 0:
-                    print('Error: You cannot have the same student ({}) in multiple groups.'.format(g[0].name))
-                    continue
-            groups.append(group)
+            print('\nYou will need to enter {} groups of {} students each.'.format(numGroups, groupSize))
+
+        # Get custom groupings from file, checking every line against the roster as it is read
+        with open(input('\nWhich custom groupings file would you like to use?\n > '), 'r') as customGroupingsFile:
+            groups, problems = validateCustomGroupings(customGroupingsFile, students, groupSize)
 
         print_groups('Tentative custom groups', groups)
+        if len(problems) > 0:
+            print('\nFound {} error{} in the custom groupings:'.format(len(problems), '' if len(problems) == 1 else 's'))
+            for problem in problems:
+                print('Error: {}'.format(problem))
+            exit()
         if (len(groups) != numGroups):
             print('Error: You must have {} groups of students.'.format(numGroups))
             exit()
-        numStudents = sum([len(group) for group in groups])
-        if (numStudents != len(students)):
-            print('Error: You must have {} students in total.'.format(len(students)))
-            exit()
+    elif schedule is not None:
+        groups = findScheduledGroups(students, schedule, history)
     else:
         # Randomize the list of students
         print('\nShuffling students...', end='')
@@ -284,41 +331,91 @@ def findGroups(students, prevGroups, customGroupings):
         # Handle odd number of students
         odd = False
         odd_student = None
-        if len(students) % GROUP_SIZE == 1:
+        if groupSize == 2 and len(students) % groupSize == 1:
             print('\nOdd number of students detected! Saving the odd student for later...', end='')
             odd = True
             odd_student = students.pop()
             print('Done\n')
 
-        # Generate all possible combinations of groups
-        combinations = generate_combinations(students)
-        new_groups = filter_combinations(combinations, prevGroups)
-        print('Total new combinations: {}/{}'.format(len(new_groups), len(combinations)))
+        # Index which pairs of students have been grouped before. Sharding only keeps the pairs that have met, so
+        # that nothing in the parent process takes memory or time proportional to n * n
+        print('Indexing previous groups...', end='')
+        with metrics.span('buildPairIndex'):
+            studentIds, pairIndex = buildPairIndex(students, prevGroups, pairCounts, sparse=shards > 1)
+        print('Done')
+        print('Total new pairs: {}/{}'.format(pairIndex.newPairs(), pairIndex.totalPairs))
+        metrics.count('matcher.students', len(students))
+        metrics.count('matcher.candidate_pairs', pairIndex.totalPairs)
+        metrics.count('matcher.filtered_pairs', pairIndex.totalPairs - pairIndex.newPairs())
+
+        # Encode each student's year and college to score how well pairs mix them
+        diversity = encodeDiversity(students, yearWeight, collegeWeight)
+
+        # Weigh repeats by how many times and how recently each pair was grouped
+        pairCost = pairIndex.count
+        if minCost:
+            print('Building recency-weighted cost matrix...', end='')
+            with metrics.span('buildCostMatrix'):
+                costMatrix = buildCostMatrix(studentIds, prevGroups)
+                if diversity:
+                    addDiversityCost(costMatrix, diversity)
+            pairCost = costMatrix.item
+            print('Done')
+        elif diversity and groupSize > 2:
+            # Score shared years and colleges pair by pair, so the search never needs an n x n matrix
+            pairCost = diversePairCost(pairIndex.count, diversity)
 
         # Find the set of groups that maximizes the number of new groups
-        participants = []
-        for i, ngrp in enumerate(new_groups):
-            temp_students = [student for student in ngrp]
-            temp_groups = [ngrp]
-            for j in range(i+1, len(new_groups)):
-                mgrp = new_groups[j]
-                if len(set(mgrp).intersection(set(temp_students))) == 0:
-                    temp_students.extend(mgrp)
-                    temp_groups.append(mgrp)
-            if len(temp_groups) > len(groups):
-                groups = temp_groups
-                participants = temp_students
+        if shards > 1:
+            # Group each shard of the roster in its own process, then group every shard's leftovers together
+            print('Grouping {} shards by {} in parallel...'.format(shards, shardBy), end='')
+            with metrics.span('shardedGroups'):
+                idGroups = shardedGroups(students, pairIndex, groupSize, shards, shardBy, timeBudget)
+            print('Done')
+        elif groupSize == 2 and minCost:
+            # A minimum cost perfect matching pairs everyone, giving leftovers their least recent partners
+            print('Finding minimum cost matching...', end='')
+            with metrics.span('minCostPairs'):
+                idGroups = [list(pair) for pair in minCostPairs(costMatrix)]
+            print('Done')
+        elif groupSize == 2:
+            # A maximum matching on the graph of new pairs is a provably maximum set of new groups
+            print('Finding maximum matching of new pairs...', end='')
+            # Start from the most diverse new partners, which keeps the matching maximum but mixes years and colleges
+            with metrics.span('maxMatching'):
+                start = diverseGreedyMatch(pairIndex, diversity) if diversity else None
+                match = maxMatching(len(students), pairIndex.newPartners, start)
+            idGroups = [[i, j] for i, j in enumerate(match) if i < j]
+            idGroups.extend(chunk([i for i, j in enumerate(match) if j == -1], groupSize))
+            print('Done')
+        else:
+            # Swap students between groups to minimize the number of repeated pairs
+            print('Searching for groups of {} with the fewest repeats...'.format(groupSize), end='')
+            with metrics.span('localSearchGroups'):
+                order = diverseOrder(diversity) if diversity else None
+                idGroups, repeats, iterations = localSearchGroups(len(students), groupSize, pairCost, timeBudget, order=order)
+            metrics.count('matcher.iterations', iterations)
+            print('Done ({} repeat cost after {} swaps)'.format(round(repeats, 2), iterations))
+
+        groups = [[students[i] for i in grp] for grp in idGroups if pairIndex.isNewGroup(grp)]
         print_groups('New groups', groups)
 
         # Group the remaining students that were not in the optimal set of groups
-        if len(participants) != len(students):
-            remaining_students = [student for student in students if student not in participants]
-            print_students('Remaining students', remaining_students)
-            old = chunk(remaining_students)
+        old = [[students[i] for i in grp] for grp in idGroups if not pairIndex.isNewGroup(grp)]
+        metrics.count('matcher.new_groups', len(groups))
+        if shards > 1:
+            newPairs = sum([pairIndex.isNew(i, j) for grp in idGroups for a, i in enumerate(grp) for j in grp[a+1:]])
+            totalPairs = sum([len(grp) * (len(grp) - 1) // 2 for grp in idGroups])
+            print('New-pair ratio: {:.4f} ({}/{} pairs)'.format(newPairs / max(1, totalPairs), newPairs, totalPairs))
+        metrics.count('matcher.old_groups', len(old))
+        if len(old) > 0:
+            print_students('Remaining students', [student for grp in old for student in grp])
             print_groups('Old groups', old)
             groups.extend(old)
 
         groups = [list(grp) for grp in groups]
+        if diversity:
+            print_mixing(groups)
 
         # Add the odd student to the first group
         if odd:
@@ -328,6 +425,43 @@ def findGroups(students, prevGroups, customGroupings):
     
     return groups
 
+# Reads the next round of pairs off the schedule, first making a new season of rounds if the schedule is used up,
+# or re-pairing only the affected students if anyone left or joined since the last round. The history (a
+# HistoryLookup) is only read for the students being (re-)paired and for each pair in the round, so a run that just
+# reads the next round takes time proportional to the roster.
+@metrics.timed
+def findScheduledGroups(students, schedule, history):
+    byEmail = history.ids.byEmail
+    timesMet = history.timesMet
+
+    if len(schedule.get('rounds', [])) == 0 or roundsLeft(schedule) == 0:
+        print('\nBuilding a new schedule...', end='')
+        schedule.update(buildSchedule(list(byEmail.keys()), timesMet))
+        print('Done ({} rounds)'.format(len(schedule['rounds'])))
+    else:
+        print('\nUpdating the schedule for students who left or joined...', end='')
+        changed = updateSchedule(schedule, list(byEmail.keys()), timesMet)
+        print('Done ({} rounds changed)'.format(changed))
+
+    pairs, bye = nextRound(schedule)
+    print('Reading round {} of {} from the schedule...Done'.format(schedule['cursor'] + 1, len(schedule['rounds'])))
+
+    groups, old = [], []
+    for a, b in pairs:
+        (groups if history.pairTimes(a, b) == 0 else old).append([students[byEmail[a]], students[byEmail[b]]])
+    print_groups('New groups', groups)
+    if len(old) > 0:
+        print_groups('Old groups', old)
+        groups.extend(old)
+
+    # Add the student with a bye this round to the first group
+    if bye is not None:
+        odd_student = students[byEmail[bye]]
+        print('\nAdding odd student ({}) to the first group...'.format(odd_student.name), end='')
+        groups[0].append(odd_student)
+        print('Done')
+    return groups
+
 def getWeekString(n, thisWeek=False, withNums=False):
     today = date.today()
     start = today + timedelta(days=(6 - today.weekday()))
@@ -341,11 +475,31 @@ def getWeekString(n, thisWeek=False, withNums=False):
     else:
         return f"{start.strftime('%m/%d/%y')} - {end.strftime('%m/%d/%y')}"
 
-def saveGroups(groups, sheet, spreadsheetId, range, week):
-    currRow = len(sheet.values().get(spreadsheetId=spreadsheetId, range=range).execute().get('values', [])) + 2
-    sheet.values().update(spreadsheetId=spreadsheetId, range=f"Sheet1!A{currRow}:B", valueInputOption='USER_ENTERED', body={
-        'values': [[week, ', '.join([student.name for student in grp])] for grp in groups]
-    }).execute()
+# Saves rows to the groups sheet and the store. A row with a replaced row (a repaired version of a group that is
+# already saved) is written over that row instead of being added, so the pairs in it aren't counted twice.
+# Returns the number of rows someone else added to the sheet since the last sync, which the store downloads along
+# the way.
+@metrics.timed
+def saveGroups(rows, sheet, store, spreadsheetId, replaces=None):
+    def emailsOf(row):
+        return tuple([normalizeEmail(email) for email in row[2].split(',')])
+
+    # Skip rows that an earlier run saved before it could mark its outbox committed
+    replaces = replaces or [None] * len(rows)
+    weeks = set([row[0] for row in rows])
+    rowOf = {(week, emails): rowNum for week in weeks for emails, rowNum in store.rowsOfWeek(spreadsheetId, week).items()}
+    pending = [(row, replaced) for row, replaced in zip(rows, replaces) if (row[0], emailsOf(row)) not in rowOf]
+
+    newRows = []
+    for row, replaced in pending:
+        rowNum = None if replaced is None else rowOf.get((replaced[0], emailsOf(replaced)))
+        if rowNum is None:
+            newRows.append(row)
+        else:
+            store.update(sheet, spreadsheetId, rowNum, row)
+    if len(newRows) == 0:
+        return 0
+    return store.append(sheet, spreadsheetId, newRows)
 
 def createMessage(sender, subject, plaintext, toEmails=None, bccEmails=None):
     message = EmailMessage()
@@ -364,53 +518,101 @@ def createMessage(sender, subject, plaintext, toEmails=None, bccEmails=None):
     }
     return body
 
-def sendMessage(service, userID, message):
-    try:
-        message = (service.users().messages().send(userId=userID, body=message).execute())
-        return message
-    except errors.HttpError as error:
-        print('Error: %s' % error)
-
-def sendEmails(groups, sender, subject, rawBody, credentials):
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('gmail', 'v1', http=http)
-    
-    groups = tqdm(groups, desc='Sending emails')
+# Prints a success/failure report for the results of sendMessages, with one label per message. Returns the labels
+# of the messages that failed.
+def print_send_report(labels, results):
+    failed = [(label, error) for label, (_, error) in zip(labels, results) if error is not None]
+    print('\nSent {}/{} emails'.format(len(labels) - len(failed), len(labels)))
+    for label, error in failed:
+        print('\tFailed: {} ({})'.format(label, error))
+    return [label for label, _ in failed]
+
+# Renders the email to each group along with the row that saves the group to the sheet.
+# Returns a list of (row, message body).
+def renderMessages(groups, sender, subject, rawBody, week, groupSize=GROUP_SIZE):
+    messages = []
     for grp in groups:
         namesLst = [student.name for student in grp]
         emailsLst = [student.email for student in grp]
         groupList = '\n'.join(namesLst)
-        if len(namesLst) > GROUP_SIZE:
-            groupList += '\n(Note: We have an odd number of students this week, so this is the lucky group with 3 students!)'
+        if len(namesLst) > groupSize:
+            groupList += '\n(Note: We have an odd number of students this week, so this is the lucky group with {} students!)'.format(len(namesLst))
         body = rawBody.replace('{GroupList}', groupList)
         emails = ', '.join(emailsLst)
-        message = createMessage(sender, subject, body, toEmails=emails)
-        sendMessage(service, "me", message)
+        messages.append(([week, ', '.join(namesLst), emails], createMessage(sender, subject, body, toEmails=emails)))
+    return messages
+
+# Sends every message in the outbox that hasn't been sent yet, marking each one sent or failed as soon as it is.
+# Returns the messages that failed.
+@metrics.timed
+def sendEmails(outbox, credentials, workers=SEND_WORKERS, rate=SEND_RATE, batchSize=BATCH_SIZE):
+    pending = outbox.pending()
 
-def sendBroadcastEmail(students, sender, subject, body, credentials):
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('gmail', 'v1', http=http)
+    def onResult(i, result, error):
+        outbox.mark(pending[i]['id'], 'sent' if error is None else 'failed', error)
 
+    results = sendMessages([message['payload'] for message in pending], credentials, workers, rate, batchSize, onResult)
+    print_send_report(['{} ({})'.format(message['row'][1], message['row'][2]) for message in pending], results)
+    return outbox.failed()
+
+@metrics.timed
+def sendBroadcastEmail(students, sender, subject, body, credentials, batchSize=BATCH_SIZE):
     emails = ', '.join([student.email for student in students])
     message = createMessage(sender, subject, body, toEmails=None, bccEmails=emails)
-    sendMessage(service, "me", message)
-
-def groupStudents(args, ids, message, credentials, students):
-    # Get previous groups
-    prevGroups, sheet = getPrevGroups(credentials, ids["GROUPS_SHEET_ID"], GROUPS_RANGE)
+    label = 'Broadcast to {} students'.format(len(students))
+    return print_send_report([label], sendMessages([message], credentials, batchSize=batchSize))
+
+# Asks a yes/no question, or answers it with default without asking when running with --yes, or with --dry-run
+# (which never sends or saves anything)
+def confirm(args, question, default=True):
+    if args.yes or args.dry_run:
+        print('\n{} (Y/n)\n> {} ({})'.format(question, 'y' if default else 'n', '--yes' if args.yes else '--dry-run'))
+        return default
+    return input('\n{} (Y/n)\n> '.format(question)).lower() == 'y'
+
+@metrics.timed
+def groupStudents(args, ids, message, credentials, students, store, prevGroups, sheet):
+    summary = {'students': len(students)}
+
+    # Check the previous groups fetched at startup
     if sheet is None:
         print('Error: Could not get previous groups.')
-        return
+        summary['status'] = 'error: could not get previous groups'
+        return summary
     print_groups('Previous groups', prevGroups, student=False)
 
-    # Find optimal groups
-    groups = findGroups(students, prevGroups, args.custom_groupings)
+    # Finish the last round first if it stopped before every email was sent and the groups were saved
+    outboxPath = outboxFile(ids["GROUPS_SHEET_ID"])
+    outbox = Outbox.load(outboxPath)
+    if outbox is not None and not outbox.committed:
+        return resumeOutbox(args, outbox, credentials, sheet, store, ids["GROUPS_SHEET_ID"], summary)
+
+    # Fix up the last round for students who dropped out or joined instead of finding new groups
+    if args.repair:
+        return repairRound(args, message, credentials, students, store, sheet, ids["GROUPS_SHEET_ID"], outbox, summary)
+
+    # Load the schedule of rounds, if using one
+    schedule, schedulePath = None, None
+    if args.schedule:
+        schedulePath = scheduleFile(ids["GROUPS_SHEET_ID"])
+        schedule = loadSchedule(schedulePath) or {}
+
+    # Find optimal groups. A schedule only looks up the history of the students it pairs, so it skips counting
+    # every pair in the history.
+    sheetId = ids["GROUPS_SHEET_ID"]
+    pairCounts = store.pairCounts(sheetId) if schedule is None else None
+    groups = findGroups(students, prevGroups, args.custom_groupings, args.group_size, args.time_budget, args.min_cost,
+                        pairCounts, schedule, args.year_weight, args.college_weight, args.shards, args.shard_by,
+                        HistoryLookup(students, store, sheetId))
+    if schedule is not None:
+        saveSchedule(schedulePath, schedule)
     print_groups('Final groups', groups, emails=True)
+    summary['groups'] = len(groups)
 
     # Confirm groups?
-    if input('\nContinue? (Y/n)\n> ').lower() != 'y':
+    if not confirm(args, 'Continue?'):
         print('Exiting...')
-        return
+        return summary
 
     # Get the week string
     week = getWeekString(args.week_group_frequency, args.this_week_group)
@@ -424,20 +626,125 @@ def groupStudents(args, ids, message, credentials, students):
     print('\n ~~~~ EMAIL END ~~~~')
 
     # Send email?
-    if input('\nSend emails? (Y/n)\n> ').lower() != 'y':
+    if not confirm(args, 'Send emails?'):
         print('Exiting...')
-        return
+        return summary
 
-    sendEmails(groups, args.email, args.subject, message, credentials)
-    print('Sending emails...Done')
+    if args.dry_run:
+        print('\nDry run: not sending emails or saving groups.')
+        summary['status'] = 'dry run'
+        return summary
 
-    # Save the groups
-    print('Saving groups...', end='')
+    # Spool every email before sending any of them, so that a run that stops halfway can be resumed
+    print('\nWriting emails to the outbox...', end='')
     week = getWeekString(args.week_group_frequency, args.this_week_group, withNums=True)
-    saveGroups(groups, sheet, ids["GROUPS_SHEET_ID"], GROUPS_RANGE, week)
+    outbox = Outbox.create(outboxPath, {'week': week, 'subject': args.subject, 'scheduled': schedule is not None},
+                           renderMessages(groups, args.email, args.subject, message, week, args.group_size))
     print('Done')
+    return deliverOutbox(args, outbox, credentials, sheet, store, ids["GROUPS_SHEET_ID"], summary)
+
+# Re-groups only the students affected by changes to the roster since the last round was sent: students no longer
+# in the roster (opted out or excluded) leave their groups, and students who signed up since join. Only the changed
+# groups are emailed and saved.
+@metrics.timed
+def repairRound(args, message, credentials, students, store, sheet, spreadsheetId, outbox, summary):
+    if outbox is None:
+        print('Error: There is no round in {} to repair.'.format(outboxFile(spreadsheetId)))
+        summary['status'] = 'error: no round to repair'
+        return summary
+
+    # The round is the groups left unchanged by earlier repairs plus the groups that were emailed
+    rows = outbox.header.get('unchanged', []) + [sent['row'] for sent in outbox.messages]
+    groups = [[normalizeEmail(email) for email in row[2].split(', ')] for row in rows]
+    byEmail = {normalizeEmail(student.email): student for student in students}
+    grouped = set([email for grp in groups for email in grp])
+    removed = [email for email in sorted(grouped) if email not in byEmail]
+    added = [email for email in byEmail if email not in grouped]
+    names = dict([(email, name) for row in rows for email, name in zip(row[2].split(', '), row[1].split(', '))])
+    print_header('Students who left', len(removed))
+    for email in removed:
+        print('\t{} ({})'.format(names.get(email, email), email))
+    print_students('Students who joined', [byEmail[email] for email in added])
+    if len(removed) == 0 and len(added) == 0:
+        print('\nNothing to repair.')
+        summary['status'] = 'nothing to repair'
+        return summary
+
+    # Look up the history of each affected student only once, as they come up
+    history = HistoryLookup(students, store, spreadsheetId)
+    unchanged, changed, origins = repairGroups(groups, removed, added, args.group_size, history.timesMet)
+    changed = [[byEmail[email] for email in grp] for grp in changed]
+    print('\nUnchanged groups: {}'.format(len(unchanged)))
+    print_groups('Changed groups', changed, emails=True)
+    summary['groups'] = len(changed)
+
+    if not confirm(args, 'Send emails to the changed groups?'):
+        print('Exiting...')
+        return summary
+    if args.dry_run:
+        print('\nDry run: not sending emails or saving groups.')
+        summary['status'] = 'dry run'
+        return summary
+
+    week = outbox.header['week']
+    unchangedRows = [[week, ', '.join([byEmail[email].name for email in grp]), ', '.join(grp)] for grp in unchanged]
+    # A changed group that came from a saved group replaces its row, so only the new pairs are added to the history
+    rowOf = {tuple(grp): row for grp, row in zip(groups, rows)}
+    replaces = [None if origin is None else rowOf[tuple(origin)] for origin in origins]
+    outbox = Outbox.create(outbox.path, {'week': week, 'subject': outbox.header['subject'], 'scheduled': False, 'unchanged': unchangedRows},
+                           renderMessages(changed, args.email, outbox.header['subject'], message, week, args.group_size), replaces)
+    return deliverOutbox(args, outbox, credentials, sheet, store, spreadsheetId, summary)
+
+# Sends what is left in the outbox of a round that stopped halfway, then saves its groups
+def resumeOutbox(args, outbox, credentials, sheet, store, spreadsheetId, summary):
+    print('\nFound an unfinished round in {} from {}: {}/{} emails sent, groups not saved.'.format(
+        outbox.path, outbox.header['created'], outbox.numSent(), len(outbox.messages)))
+    print('Subject: [YSC MealBot] {}'.format(outbox.header['subject']))
+    summary['groups'] = len(outbox.messages)
+    if not confirm(args, 'Finish sending it? (Delete {} to throw it away instead.)'.format(outbox.path)):
+        print('Exiting...')
+        return summary
+    if args.dry_run:
+        print('\nDry run: not sending emails or saving groups.')
+        summary['status'] = 'dry run'
+        return summary
+    return deliverOutbox(args, outbox, credentials, sheet, store, spreadsheetId, summary)
+
+# Drains the outbox, then saves its groups and marks it committed. If any emails failed, the outbox is kept open
+# (unless you save anyway) so that the next run retries only those.
+@metrics.timed
+def deliverOutbox(args, outbox, credentials, sheet, store, spreadsheetId, summary):
+    failed = sendEmails(outbox, credentials, args.send_workers, args.send_rate, args.batch_size)
+    print('Sending emails...Done')
+    summary['emailed'] = outbox.numSent()
+    summary['failed'] = len(failed)
+    if len(failed) > 0 and not confirm(args, 'Save the groups anyway? (No keeps the outbox to retry the failed emails next run.)',
+                                       default=args.save_on_failure):
+        print('Exiting...')
+        summary['status'] = 'failed emails kept in {}'.format(outbox.path)
+        return summary
 
+    # Save the groups, then mark the outbox done so that the round is never sent again
+    print('Saving groups...', end='')
+    numGap = saveGroups([message['row'] for message in outbox.messages], sheet, store, spreadsheetId,
+                        [message.get('replaces') for message in outbox.messages])
+    outbox.commit()
+    print('Done' if numGap == 0 else 'Done (also mirrored {} rows added to the sheet since the last sync)'.format(numGap))
+    summary['status'] = 'saved'
+
+    # Move the schedule on to the next round
+    if outbox.header.get('scheduled'):
+        schedulePath = scheduleFile(spreadsheetId)
+        schedule = loadSchedule(schedulePath)
+        advance(schedule)
+        saveSchedule(schedulePath, schedule)
+        print('{} rounds left in the schedule'.format(roundsLeft(schedule)))
+    return summary
+
+@metrics.timed
 def broadcast(args, message, credentials, students):
+    summary = {'students': len(students)}
+
     # Print the email template
     print('\n ~~~~ EMAIL START ~~~~')
     print('\nFrom: {}'.format(args.email))
@@ -446,17 +753,28 @@ def broadcast(args, message, credentials, students):
     print('\n ~~~~ EMAIL END ~~~~')
 
     # Send email?
-    if input('\nSend emails? (Y/n)\n> ').lower() != 'y':
+    if not confirm(args, 'Send emails?'):
         print('Exiting...')
-        return
+        return summary
+
+    if args.dry_run:
+        print('\nDry run: not sending emails.')
+        summary['status'] = 'dry run'
+        return summary
 
     # Send broadcast email with all students BCC'd
-    sendBroadcastEmail(students, args.email, args.subject, message, credentials)
+    failed = sendBroadcastEmail(students, args.email, args.subject, message, credentials, args.batch_size)
     print('Sending emails...Done')
+    summary['emailed'] = len(students) if len(failed) == 0 else 0
+    summary['failed'] = len(students) if len(failed) > 0 else 0
+    summary['status'] = 'sent'
+    return summary
 
+@metrics.timed
 def mealBot(args):
-    # Read the ids file
-    ids = getIds(IDS_FILE)
+    # Read the ids file, with any overrides from the cohort config
+    ids = getIds(args.ids_file)
+    ids.update(getattr(args, 'ids', None) or {})
 
     # Read the broadcast file
     message = getMessage(args.message_file)
@@ -464,24 +782,60 @@ def mealBot(args):
     # Get credentials
     credentials = getCredentials(CREDENTIALS_FILE, TOKEN_FILE, ids["APPLICATION_NAME"])
 
-    # Get a list of students
-    students = getStudents(credentials, ids)
-    students = excludeStudents(students)
+    # Read the exclude file and fetch the form responses and previous groups all at once
+    print('Fetching students and previous groups...')
+    store = None if args.broadcast else GroupStore(GROUPS_DB)
+    tasks = {
+        'exclude file': (getExcludeRules, [args.exclude_file]),
+        'form responses': (getResponses, [credentials, ids, args.refresh_responses]),
+    }
+    if not args.broadcast:
+        tasks['previous groups'] = (getPrevGroups, [credentials, ids["GROUPS_SHEET_ID"], store, args.resync_groups])
+    results, failures = runConcurrently(tasks)
+    if len(failures) > 0:
+        for name, error in failures.items():
+            print('Error: Could not get the {}: {}'.format(name, error))
+        return {'status': 'error: could not get the {}'.format(', '.join(failures))}
+
+    # Get a list of students, leaving out the excluded ones
+    students = getStudents(results['form responses'], ids, results['exclude file'])
     print_students('Students', students)
 
     if len(students) == 1:
         print('Error: You must have more than 1 student.')
-        return
+        return {'students': len(students), 'status': 'error: you must have more than 1 student'}
 
     # Confirm students?
-    if input('\nContinue? (Y/n)\n> ').lower() != 'y':
+    if not confirm(args, 'Continue?'):
         print('Exiting...')
-        return
+        return {'students': len(students), 'status': 'cancelled'}
 
     if args.broadcast:
-        broadcast(args, message, credentials, students)
-    else:
-        groupStudents(args, ids, message, credentials, students)
+        return broadcast(args, message, credentials, students)
+    prevGroups, sheet = results['previous groups']
+    return groupStudents(args, ids, message, credentials, students, store, prevGroups, sheet)
+
+# Checks the options that argparse can't check on its own. Cohort configs override options after parsing, so every
+# cohort's options are checked here too. Raises a ValueError describing the first problem found.
+def checkArgs(args):
+    if args.group_size < 2:
+        raise ValueError('--group-size must be at least 2')
+    if args.schedule and args.group_size != 2:
+        raise ValueError('--schedule only works with groups of 2')
+    if args.shards < 1:
+        raise ValueError('--shards must be at least 1')
+    if args.shards > 1 and (args.min_cost or args.schedule or args.year_weight or args.college_weight):
+        raise ValueError('--shards can\'t be used with --min-cost, --schedule, --year-weight or --college-weight')
+    if args.shard_by not in SHARD_BY:
+        raise ValueError('--shard-by must be one of {}'.format(', '.join(SHARD_BY)))
+    if args.year_weight < 0 or args.college_weight < 0:
+        raise ValueError('--year-weight and --college-weight can\'t be negative')
+    if not 1 <= args.week_group_frequency <= 52:
+        raise ValueError('--week-group-frequency must be from 1 to 52')
+    if not 0 <= args.batch_size <= 100:
+        raise ValueError('--batch-size must be from 0 to 100')
+    if args.cohorts and not (args.yes or args.dry_run):
+        raise ValueError('--cohorts runs without prompts, so it needs --yes or --dry-run')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='''Randomly group students to get a meal together and 
@@ -496,6 +850,41 @@ if __name__ == '__main__':
                         help='''File containing the email body ({GroupList} in the file will be replaced 
                                 with the list of students in the group). Defaults to '''+DEFAULT_MESSAGE_FILE,
                         default=DEFAULT_MESSAGE_FILE)
+    parser.add_argument('--ids-file',
+                        help='''JSON file with the form, sheet and question ids. Defaults to '''+IDS_FILE,
+                        default=IDS_FILE)
+    parser.add_argument('--exclude-file',
+                        help='''File with the emails (or domains, as *@example.edu) of students to leave out, one
+                                per line. Defaults to '''+EXCLUDE_FILE,
+                        default=EXCLUDE_FILE)
+    parser.add_argument('-y', '--yes',
+                        help='''Answer yes to every prompt instead of asking. Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--save-on-failure',
+                        help='''With --yes, save the groups even if some emails failed to send, instead of keeping the
+                                outbox so that the next run retries them. Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--dry-run',
+                        help='''Get the students and find the groups, but don't send any emails or save the groups.
+                                Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--cohorts',
+                        help='''JSON file with a list of cohort configs to run without prompts, each in its own
+                                process (requires --yes or --dry-run). Each config has a "name" and overrides any
+                                of the other options by their long name with underscores (e.g. "message_file",
+                                "exclude_file", "week_group_frequency"), plus "ids" to override entries of the ids
+                                file (e.g. "SIGNUP_FORM_ID" and "GROUPS_SHEET_ID").''',
+                        default=None)
+    parser.add_argument('--workers',
+                        help='''Number of cohorts to run at once with --cohorts. Defaults to the number of CPUs.''',
+                        default=None,
+                        type=int)
     parser.add_argument('-b', '--broadcast',
                         help='''Send a broadcast email to all students. Defaults to False.''',
                         default=False, const=True,
@@ -520,7 +909,101 @@ if __name__ == '__main__':
                         default=2,
                         type=int,
                         choices=range(1, 53))
+    parser.add_argument('-g', '--group-size',
+                        help='''Number of students in each group (2 or more). Groups of 2 are found with a maximum
+                                matching; larger groups are found with a local search that minimizes repeated
+                                pairs. Defaults to '''+str(GROUP_SIZE),
+                        default=GROUP_SIZE,
+                        type=int)
+    parser.add_argument('--min-cost',
+                        help='''Weigh previous groups by how many times and how recently each pair was grouped, and
+                                find the groups with the lowest total weight, so that students who have run out
+                                of new partners get their least recent ones. Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--year-weight',
+                        help='''Extra cost of grouping two students in the same year, so that groups mix years. 1 is
+                                as costly as one previous meeting. Defaults to '''+str(YEAR_WEIGHT),
+                        default=YEAR_WEIGHT,
+                        type=float)
+    parser.add_argument('--college-weight',
+                        help='''Extra cost of grouping two students in the same college, so that groups mix colleges.
+                                1 is as costly as one previous meeting. Defaults to '''+str(COLLEGE_WEIGHT),
+                        default=COLLEGE_WEIGHT,
+                        type=float)
+    parser.add_argument('--send-workers',
+                        help='''Number of emails to send at once. Defaults to '''+str(SEND_WORKERS),
+                        default=SEND_WORKERS,
+                        type=int)
+    parser.add_argument('--send-rate',
+                        help='''Average number of emails to send per second. Defaults to '''+str(SEND_RATE)+''',
+                                which keeps within the Gmail API per-user quota.''',
+                        default=SEND_RATE,
+                        type=float)
+    parser.add_argument('--batch-size',
+                        help='''Number of emails to pack into each Gmail batch request (at most 100), or 0 to send
+                                each email in its own request. Defaults to '''+str(BATCH_SIZE),
+                        default=BATCH_SIZE,
+                        type=int,
+                        choices=range(0, 101))
+    parser.add_argument('--refresh-responses',
+                        help='''Download every form response again instead of only the ones submitted or edited since
+                                the last run (e.g. after deleting responses). Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--resync-groups',
+                        help='''Download every row of the groups sheet again instead of only the rows added since the
+                                last run (e.g. after editing old rows by hand). Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--metrics',
+                        help='''Time each phase of the run, each Google API call, and the grouping, and write the
+                                metrics as JSON to this file (or print a summary if it is -). With --cohorts,
+                                each cohort writes its own file with the cohort's name added.''',
+                        default=None)
+    parser.add_argument('--schedule',
+                        help='''Pair students from a precomputed season of rounds with no repeated pairs instead of
+                                matching from scratch each time. Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--shards',
+                        help='''Split the roster into this many shards, group each shard in its own process, and group
+                                the students left over in every shard together at the end. Uses less memory, but is
+                                only faster for rosters of about 10,000 students or more. Defaults to 1 (no
+                                sharding).''',
+                        default=1,
+                        type=int)
+    parser.add_argument('--shard-by',
+                        help='''How to split the roster into shards: random (default), hash (of the email, so the
+                                same students share a shard every run) or college.''',
+                        default='random',
+                        choices=SHARD_BY)
+    parser.add_argument('--repair',
+                        help='''Re-group only the students affected by changes to the roster since the last round was
+                                sent, and email and save only the changed groups. Defaults to False.''',
+                        default=False, const=True,
+                        type=str2bool,
+                        nargs='?')
+    parser.add_argument('--time-budget',
+                        help='''Seconds to spend searching for groups larger than 2. Defaults to '''+str(TIME_BUDGET),
+                        default=TIME_BUDGET,
+                        type=float)
 
     args = parser.parse_args()
+    try:
+        checkArgs(args)
+    except ValueError as error:
+        parser.error(error)
 
-    mealBot(args)
\ No newline at end of file
+    if args.cohorts:
+        runCohorts(args, getCohorts(args.cohorts), args.workers)
+    else:
+        if args.metrics:
+            metrics.enable()
+        mealBot(args)
+        if args.metrics:
+            metrics.write(args.metrics)
\ No newline at end of file
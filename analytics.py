@@ -0,0 +1,243 @@
+# ------------- MEAL BOT ANALYTICS -------------
+# Reports how the pairing history is filling up: which students are running out of new partners, how many repeats
+# each round had to use, and how many weeks are left before the students in the last round run out of new partners.
+# Reads the groups mirrored in groups.db by the last MealBot.py run, so it doesn't use any Google APIs. The history is
+# packed into analytics_cache/ so that later reports only read the groups added since.
+#
+# Usage:
+# `python analytics.py`
+#   Prints the report for the groups sheet in ids.json.
+# `python analytics.py --csv report --json report.json`
+#   Also writes report/students.csv and report/rounds.csv, and the whole report as JSON.
+
+import argparse
+import csv
+import json
+import os
+from statistics import median
+
+import numpy as np
+
+from costs import parseWeekStart
+from store import GroupStore, GROUPS_DB
+from utils import atomicWrite
+
+IDS_FILE            = 'ids.json'
+ANALYTICS_CACHE_DIR = 'analytics_cache'
+DEFAULT_FREQUENCY   = 2     # weeks between rounds when the week strings can't be parsed
+
+# Packs history rows (row, key) into a (groupings x largest group) array of ids, interning new keys onto keyIds and
+# new weeks onto roundIds. Returns the sheet row of each grouping, the member array and the round of each grouping.
+def packRows(records, rowWeeks, keyIds, roundIds):
+    rowNums = np.array([record[0] for record in records], dtype=np.int64)
+    ids = np.array([keyIds.setdefault(record[1], len(keyIds)) for record in records], dtype=np.int64)
+
+    # Records are ordered by row and position, so each grouping is one run of records
+    starts = np.flatnonzero(np.r_[True, rowNums[1:] != rowNums[:-1]])
+    sizes = np.diff(np.r_[starts, len(records)])
+    groupingOf = np.repeat(np.arange(len(starts)), sizes)
+    members = np.full((len(starts), sizes.max()), -1, dtype=np.int64)
+    members[groupingOf, np.arange(len(records)) - starts[groupingOf]] = ids
+
+    # Every grouping has members, so rowWeeks lines up with the groupings
+    roundOf = np.array([roundIds.setdefault(week, len(roundIds)) for _, week in rowWeeks], dtype=np.int64)
+    return rowNums[starts], members, roundOf
+
+def cacheFileFor(cacheDir, sheetId):
+    return os.path.join(cacheDir, '{}.npz'.format(sheetId))
+
+# Loads the packed history of a sheet from its cache, or None if there's no cache or the store no longer has the
+# same groupings: its generation changed (after --resync-groups or a row was replaced) or it has another count of them
+def loadCache(store, sheetId, cacheFile):
+    if not os.path.exists(cacheFile):
+        return None
+    with np.load(cacheFile) as cache:
+        cache = {name: cache[name] for name in cache.files}
+    rows = cache['rows']
+    if 'generation' not in cache or int(cache['generation']) != store.generation(sheetId):
+        return None
+    if len(rows) == 0 or store.groupingsUpTo(sheetId, int(rows[-1])) != len(rows):
+        return None
+    return cache
+
+def saveCache(cacheFile, cache):
+    atomicWrite(cacheFile, lambda f: np.savez(f, **cache), binary=True)
+
+# Loads the history of a sheet as a (groupings x largest group) array of student ids padded with -1, with the
+# round (distinct week, in the order they first appear) of each grouping. Students are keyed on email, or on name
+# for old rows saved without emails. The packed history is cached in cacheDir, so only the groupings added to the
+# store since the last report are read from it.
+# Returns the member array, the round of each grouping, the week of each round, each student's key, and the first
+# sheet row of the last round.
+def loadHistory(store, sheetId, cacheDir=ANALYTICS_CACHE_DIR):
+    cacheFile = cacheFileFor(cacheDir, sheetId)
+    generation = store.generation(sheetId)
+    cache = loadCache(store, sheetId, cacheFile) or {
+        'rows': np.zeros(0, dtype=np.int64), 'members': np.full((0, 1), -1, dtype=np.int64),
+        'roundOf': np.zeros(0, dtype=np.int64), 'keys': np.array([], dtype=str), 'weeks': np.array([], dtype=str)}
+
+    afterRow = int(cache['rows'][-1]) if len(cache['rows']) else 0
+    records, rowWeeks = store.members(sheetId, afterRow)
+    keys, weeks = cache['keys'].tolist(), cache['weeks'].tolist()
+    if len(records) > 0:
+        keyIds = {key: i for i, key in enumerate(keys)}
+        roundIds = {week: i for i, week in enumerate(weeks)}
+        rows, members, roundOf = packRows(records, rowWeeks, keyIds, roundIds)
+        keys, weeks = list(keyIds), list(roundIds)
+        width = max(cache['members'].shape[1], members.shape[1])
+        pad = lambda array: np.pad(array, ((0, 0), (0, width - array.shape[1])), constant_values=-1)
+        cache = {'rows': np.r_[cache['rows'], rows], 'members': np.vstack([pad(cache['members']), pad(members)]),
+                 'roundOf': np.r_[cache['roundOf'], roundOf], 'keys': np.array(keys), 'weeks': np.array(weeks),
+                 'generation': np.array(generation)}
+        saveCache(cacheFile, cache)
+
+    if len(weeks) == 0:
+        return cache['members'], cache['roundOf'], [], [], 0
+    lastRoundStart = int(cache['rows'][np.argmax(cache['roundOf'] == len(weeks) - 1)])
+    return cache['members'], cache['roundOf'], weeks, keys, lastRoundStart
+
+# Returns every pair in the member array as arrays of (i, j, row), with i != j
+def historyPairs(members):
+    pairs = []
+    width = members.shape[1]
+    for a in range(width):
+        for b in range(a + 1, width):
+            i, j = members[:, a], members[:, b]
+            mask = (i >= 0) & (j >= 0) & (i != j)
+            pairs.append((i[mask], j[mask], np.flatnonzero(mask)))
+    if len(pairs) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return tuple(np.concatenate(part) for part in zip(*pairs))
+
+# Replays the history round by round into an n x n pair count matrix, counting the pairs in each round that had
+# already been grouped in an earlier round. Returns the final matrix and a list of per-round stats.
+def replayRounds(members, roundOf, weeks, n):
+    i, j, rows = historyPairs(members)
+    pairRound = roundOf[rows]
+    order = np.argsort(pairRound, kind='stable')
+    i, j, pairRound = i[order], j[order], pairRound[order]
+    bounds = np.searchsorted(pairRound, np.arange(len(weeks) + 1))
+    groupsPerRound = np.bincount(roundOf, minlength=len(weeks))
+
+    counts = np.zeros((n, n), dtype=np.uint16)
+    rounds = []
+    for r, week in enumerate(weeks):
+        ii, jj = i[bounds[r]:bounds[r + 1]], j[bounds[r]:bounds[r + 1]]
+        repeats = int(np.count_nonzero(counts[ii, jj]))
+        np.add.at(counts, (ii, jj), 1)
+        np.add.at(counts, (jj, ii), 1)
+        rounds.append({'week': week, 'groups': int(groupsPerRound[r]), 'pairs': len(ii), 'repeats': repeats,
+                       'repeat_rate': round(repeats / len(ii), 4) if len(ii) else 0.0})
+    return counts, rounds
+
+# Returns the typical number of weeks between rounds, from the start dates in the week strings
+def weeksPerRound(weeks):
+    starts = sorted(set([start for start in map(parseWeekStart, weeks) if start is not None]))
+    gaps = [(b - a).days / 7 for a, b in zip(starts, starts[1:])]
+    return max(1, round(median(gaps))) if gaps else DEFAULT_FREQUENCY
+
+# Builds the whole report for a groups sheet. Novelty is measured among the students in the last round: how many of
+# them each student has never been grouped with, and how many rounds of new partners that leaves them.
+def buildReport(store, sheetId):
+    members, roundOf, weeks, keys, lastRoundStart = loadHistory(store, sheetId)
+    n = len(keys)
+    counts, rounds = replayRounds(members, roundOf, weeks, n)
+    if len(weeks) == 0:
+        return {'summary': {'rounds': 0, 'students': 0}, 'rounds': [], 'students': []}
+
+    lastRows = members[roundOf == len(weeks) - 1]
+    active = np.unique(lastRows[lastRows >= 0])
+    sizes = (lastRows >= 0).sum(axis=1)
+    groupSize = int(np.bincount(sizes).argmax())
+    partnersPerRound = max(1, groupSize - 1)
+    frequency = weeksPerRound(weeks)
+
+    met = counts[np.ix_(active, active)] > 0
+    newLeft = len(active) - 1 - met.sum(axis=1)
+    roundsLeft = newLeft // partnersPerRound
+    timesGrouped = np.bincount(members[members >= 0], minlength=n)
+    partners = (counts > 0).sum(axis=1)
+    names = store.namesSince(sheetId, lastRoundStart)
+
+    students = [{'student': keys[s], 'name': names.get(keys[s], keys[s][len('name:'):]), 'times_grouped': int(timesGrouped[s]),
+                 'distinct_partners': int(partners[s]), 'new_partners_left': int(left), 'rounds_left': int(r),
+                 'weeks_left': int(r) * frequency}
+                for s, left, r in sorted(zip(active.tolist(), newLeft.tolist(), roundsLeft.tolist()), key=lambda row: (row[1], row[0]))]
+
+    totalPairs = len(active) * (len(active) - 1) // 2
+    usedPairs = int(met.sum()) // 2
+    newPairsPerRound = max(1, len(active) * partnersPerRound // 2)
+    summary = {
+        'rounds': len(weeks),
+        'groups': int(len(members)),
+        'students': n,
+        'active_students': len(active),
+        'group_size': groupSize,
+        'weeks_per_round': frequency,
+        'pairs_used': usedPairs,
+        'pairs_total': totalPairs,
+        'pair_space_used': round(usedPairs / totalPairs, 4) if totalPairs else 1.0,
+        'students_out_of_new_partners': int((roundsLeft == 0).sum()),
+        'weeks_until_first_student_runs_out': int(roundsLeft.min()) * frequency if len(active) else 0,
+        'weeks_until_median_student_runs_out': int(np.median(roundsLeft)) * frequency if len(active) else 0,
+        'weeks_until_pair_space_is_full': (totalPairs - usedPairs) // newPairsPerRound * frequency,
+        'last_round_repeat_rate': rounds[-1]['repeat_rate'],
+    }
+    return {'summary': summary, 'rounds': rounds, 'students': students}
+
+def print_report(report, top=10):
+    summary = report['summary']
+    if summary['rounds'] == 0:
+        print('No previous groups.')
+        return
+    print('History: {rounds} rounds, {groups} groups, {students} students ({active_students} in the last round)'.format(**summary))
+    print('Pairs used among the last round\'s students: {}/{} ({:.1%})'.format(summary['pairs_used'], summary['pairs_total'], summary['pair_space_used']))
+
+    print('\nRounds [{}]:'.format(len(report['rounds'])))
+    for rnd in report['rounds']:
+        print('\t{}: {} groups, {}/{} repeated pairs ({:.1%})'.format(rnd['week'], rnd['groups'], rnd['repeats'], rnd['pairs'], rnd['repeat_rate']))
+
+    print('\nStudents with the fewest new partners left:')
+    for student in report['students'][:top]:
+        print('\t{}: {} new partners left (~{} weeks)'.format(student['name'], student['new_partners_left'], student['weeks_left']))
+
+    print('\nStudents out of new partners: {}'.format(summary['students_out_of_new_partners']))
+    print('Projected weeks until the first student runs out: {}'.format(summary['weeks_until_first_student_runs_out']))
+    print('Projected weeks until the median student runs out: {}'.format(summary['weeks_until_median_student_runs_out']))
+    print('Projected weeks until every pair has been used: {}'.format(summary['weeks_until_pair_space_is_full']))
+
+def writeCsv(filename, rows):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Report how the pairing history is filling up.''')
+    parser.add_argument('--ids-file', help='JSON file with the groups sheet id. Defaults to '+IDS_FILE, default=IDS_FILE)
+    parser.add_argument('--sheet-id', help='Groups sheet to report on. Defaults to GROUPS_SHEET_ID in the ids file', default=None)
+    parser.add_argument('--db', help='Groups database written by MealBot.py. Defaults to '+GROUPS_DB, default=GROUPS_DB)
+    parser.add_argument('--rebuild', help='Read all of the history from the database again instead of only new rows',
+                        default=False, action='store_true')
+    parser.add_argument('--top', help='Number of students with the fewest new partners left to print. Defaults to 10',
+                        default=10, type=int)
+    parser.add_argument('--csv', help='Directory to write students.csv and rounds.csv to', default=None)
+    parser.add_argument('--json', help='File to write the whole report to as JSON', default=None)
+    args = parser.parse_args()
+
+    sheetId = args.sheet_id
+    if sheetId is None:
+        with open(args.ids_file, 'r') as idsFile:
+            sheetId = json.load(idsFile)['GROUPS_SHEET_ID']
+
+    if args.rebuild and os.path.exists(cacheFileFor(ANALYTICS_CACHE_DIR, sheetId)):
+        os.remove(cacheFileFor(ANALYTICS_CACHE_DIR, sheetId))
+    report = buildReport(GroupStore(args.db), sheetId)
+    print_report(report, args.top)
+    if args.csv:
+        os.makedirs(args.csv, exist_ok=True)
+        writeCsv(os.path.join(args.csv, 'students.csv'), report['students'])
+        writeCsv(os.path.join(args.csv, 'rounds.csv'), report['rounds'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,156 @@
+# ------------- MEAL BOT BENCHMARK -------------
+# Measures how the grouping step scales on synthetic rosters and histories, without touching any Google APIs.
+#
+# Usage:
+# `python bench.py`
+#   Runs every grouping mode on rosters of 50 to 3,000 students with 0 to 100 past rounds and prints the results
+#   as JSON: wall time, peak memory, and grouping quality (new-pair ratio and repeated pairs) for each run.
+# `python bench.py --sizes 10000 --rounds 100 --modes match --output bench.json`
+#   Benchmarks only the maximum matching on 10,000 students with 100 past rounds and writes the results to a file.
+# `python bench.py --sizes 10000 --modes match --shards 1 4 8`
+#   Compares sharded runs with the unsharded run of the same roster (new-pair ratio difference and speedup).
+# `python bench.py --modes match local --diversity 0.5`
+#   Adds year and college diversity costs of 0.5 to compare against the runs without them.
+
+import argparse
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from itertools import combinations
+
+from MealBot import Student, findGroups, TIME_BUDGET
+from history import buildPairIndex
+from shards import SHARD_BY
+
+DEFAULT_SIZES   = [50, 300, 1000, 3000]
+DEFAULT_ROUNDS  = [0, 10, 100]
+MODES           = ['match', 'min-cost', 'local']
+YEARS           = ['2025', '2026', '2027', '2028']
+COLLEGES        = ['Benjamin Franklin', 'Berkeley', 'Branford', 'Davenport', 'Ezra Stiles', 'Grace Hopper',
+                   'Jonathan Edwards', 'Morse', 'Pauli Murray', 'Pierson', 'Saybrook', 'Silliman', 'Timothy Dwight',
+                   'Trumbull']
+
+def makeStudents(n, rng):
+    return [Student({
+        'firstname': 'Student{}'.format(i),
+        'lastname': 'Synthetic',
+        'year': rng.choice(YEARS),
+        'college': rng.choice(COLLEGES),
+        'email': 'student{}@example.edu'.format(i)
+    }) for i in range(n)]
+
+# Builds rounds of random groups of groupSize, one every two weeks going back from today, in the same
+# [week, names, emails] form as getPrevGroups
+def makeHistory(students, rounds, groupSize, rng):
+    history = []
+    today = date.today()
+    for r in range(rounds, 0, -1):
+        start = today - timedelta(weeks=2 * r)
+        week = 'Week 01 & 02 | {} - {}'.format(start.strftime('%m/%d/%y'), (start + timedelta(days=13)).strftime('%m/%d/%y'))
+        order = list(students)
+        rng.shuffle(order)
+        for i in range(0, len(order) - groupSize + 1, groupSize):
+            grp = order[i:i + groupSize]
+            history.append([week, tuple(student.name for student in grp), tuple(student.email for student in grp)])
+    return history
+
+# Returns the fraction of pairs within the groups that have never been grouped before and the number that have
+def measureQuality(students, history, groups):
+    _, pairIndex = buildPairIndex(students, history)
+    position = {id(student): i for i, student in enumerate(students)}
+    pairs = repeats = 0
+    for grp in groups:
+        for a, b in combinations(grp, 2):
+            pairs += 1
+            if not pairIndex.isNew(position[id(a)], position[id(b)]):
+                repeats += 1
+    return (pairs - repeats) / pairs if pairs else 1.0, repeats
+
+# Returns the fraction of groups with students from more than one value of the attribute
+def mixedRatio(groups, attribute):
+    mixed = sum([1 for grp in groups if len(set([getattr(student, attribute) for student in grp])) > 1])
+    return mixed / len(groups) if groups else 1.0
+
+def runOne(mode, n, rounds, groupSize, timeBudget, seed, diversity=0.0, shards=1, shardBy='random'):
+    groupSize = groupSize if mode == 'local' else 2
+    rng = random.Random(seed)
+    random.seed(seed)
+    students = makeStudents(n, rng)
+    history = makeHistory(students, rounds, groupSize, rng)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        groups = findGroups(list(students), history, False, groupSize, timeBudget, minCost=(mode == 'min-cost'),
+                            yearWeight=diversity, collegeWeight=diversity, shards=shards, shardBy=shardBy)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    newPairRatio, repeats = measureQuality(students, history, groups)
+    return {
+        'mode': mode,
+        'students': n,
+        'rounds': rounds,
+        'group_size': groupSize,
+        'diversity': diversity,
+        'shards': shards,
+        'history_rows': len(history),
+        'seconds': round(seconds, 4),
+        'peak_memory_mb': round(peak / 2**20, 2),
+        'groups': len(groups),
+        'new_pair_ratio': round(newPairRatio, 4),
+        'repeats': repeats,
+        'mixed_year_ratio': round(mixedRatio(groups, 'year'), 4),
+        'mixed_college_ratio': round(mixedRatio(groups, 'college'), 4),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Benchmark the grouping step on synthetic rosters and histories.''')
+    parser.add_argument('--sizes', help='Roster sizes. Defaults to '+' '.join(map(str, DEFAULT_SIZES)),
+                        default=DEFAULT_SIZES, type=int, nargs='+')
+    parser.add_argument('--rounds', help='Numbers of past rounds. Defaults to '+' '.join(map(str, DEFAULT_ROUNDS)),
+                        default=DEFAULT_ROUNDS, type=int, nargs='+')
+    parser.add_argument('--modes', help='Grouping modes to run. Defaults to all of '+' '.join(MODES),
+                        default=MODES, choices=MODES, nargs='+')
+    parser.add_argument('-g', '--group-size', help='Group size for the local mode. Defaults to 3',
+                        default=3, type=int)
+    parser.add_argument('--time-budget', help='Seconds for the local search. Defaults to '+str(TIME_BUDGET),
+                        default=TIME_BUDGET, type=float)
+    parser.add_argument('--diversity', help='Year and college weight for the diversity objective. Defaults to 0',
+                        default=0.0, type=float)
+    parser.add_argument('--shards', help='Numbers of shards to split the roster into (match and local modes). Defaults to 1',
+                        default=[1], type=int, nargs='+')
+    parser.add_argument('--shard-by', help='How to split the roster into shards. Defaults to random',
+                        default='random', choices=SHARD_BY)
+    parser.add_argument('--seed', help='Random seed. Defaults to 0', default=0, type=int)
+    parser.add_argument('-o', '--output', help='File to write the JSON results to. Defaults to stdout', default=None)
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        for n in args.sizes:
+            for rounds in args.rounds:
+                baseline = None
+                for shards in (args.shards if mode != 'min-cost' else [1]):
+                    result = runOne(mode, n, rounds, args.group_size, args.time_budget, args.seed, args.diversity, shards, args.shard_by)
+                    # Compare sharded runs with the unsharded run of the same roster and history
+                    if shards == 1:
+                        baseline = result
+                    elif baseline is not None:
+                        result['new_pair_ratio_vs_unsharded'] = round(result['new_pair_ratio'] - baseline['new_pair_ratio'], 4)
+                        result['speedup_vs_unsharded'] = round(baseline['seconds'] / max(result['seconds'], 1e-9), 2)
+                    results.append(result)
+                    print('{mode} n={students} rounds={rounds} shards={shards}: {seconds}s, {peak_memory_mb} MB, new-pair ratio {new_pair_ratio}'.format(**result), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
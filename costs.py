@@ -0,0 +1,209 @@
+import re
+from datetime import date, datetime
+
+import networkx as nx
+import numpy as np
+
+from matching import maxMatching
+
+RECENCY_WEIGHT      = 1.0
+RECENCY_HALF_LIFE   = 56    # days
+CANDIDATES          = 32
+DENSE_LIMIT         = 400
+YEAR_WEIGHT         = 0.0
+COLLEGE_WEIGHT      = 0.0
+
+WEEK_START = re.compile(r'(\d{2}/\d{2}/\d{2}) - \d{2}/\d{2}/\d{2}')
+
+# Returns the start date of a week string written by getWeekString, or None if it can't be parsed
+def parseWeekStart(week):
+    match = WEEK_START.search(week)
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), '%m/%d/%y').date()
+
+# Packs the history rows into an (rows x largest group) array of student ids, padded with -1, along with
+# the age in days of each row. Rows whose week can't be parsed are treated as the oldest row.
+def packHistory(ids, prevGroups, today=None):
+    today = today or date.today()
+    resolved = [ids.resolve(row[1], row[2]) for row in prevGroups]
+    width = max([len(members) for members in resolved], default=0)
+    members = np.full((len(resolved), max(width, 1)), -1, dtype=np.int64)
+    for r, row in enumerate(resolved):
+        members[r, :len(row)] = row
+
+    starts = {}
+    for row in prevGroups:
+        if row[0] not in starts:
+            starts[row[0]] = parseWeekStart(row[0])
+    known = [(today - start).days for start in starts.values() if start is not None]
+    oldest = max(known, default=0)
+    ageOf = {week: oldest if start is None else (today - start).days for week, start in starts.items()}
+    ages = np.array([ageOf[row[0]] for row in prevGroups], dtype=np.float64)
+    return members, ages
+
+# Builds an n x n matrix of how costly it is to group each pair of students again. Every time a pair was
+# grouped adds 1, plus recencyWeight decayed by half every halfLife days since that week, so pairs that met
+# often or recently cost the most. The diagonal is set above every other cost.
+def buildCostMatrix(ids, prevGroups, recencyWeight=RECENCY_WEIGHT, halfLife=RECENCY_HALF_LIFE, today=None):
+    n = len(ids)
+    cost = np.zeros((n, n), dtype=np.float32)
+    members, ages = packHistory(ids, prevGroups, today)
+    weights = (1.0 + recencyWeight * np.exp2(-np.maximum(ages, 0) / halfLife)).astype(np.float32)
+
+    width = members.shape[1]
+    for a in range(width):
+        for b in range(a + 1, width):
+            i, j = members[:, a], members[:, b]
+            mask = (i >= 0) & (j >= 0)
+            np.add.at(cost, (i[mask], j[mask]), weights[mask])
+    cost += cost.T
+    np.fill_diagonal(cost, cost.max(initial=0) + 1)
+    return cost
+
+# Encodes the students' values of an attribute (e.g. 'college') as integer codes, comparing them case-insensitively.
+# Students who left it blank get -1.
+def encodeAttribute(students, attribute):
+    codes = {}
+    values = [str(getattr(student, attribute) or '').strip().casefold() for student in students]
+    return np.array([codes.setdefault(value, len(codes)) if value else -1 for value in values], dtype=np.int64)
+
+# Encodes the year and college of each student along with the weight of sharing it, skipping attributes with no
+# weight. Returns a list of (codes, weight).
+def encodeDiversity(students, yearWeight=YEAR_WEIGHT, collegeWeight=COLLEGE_WEIGHT):
+    return [(encodeAttribute(students, attribute), np.float32(weight))
+            for attribute, weight in [('year', yearWeight), ('college', collegeWeight)] if weight != 0]
+
+# Adds the diversity cost of every pair of students to an n x n cost matrix, so that cheaper groups mix years and
+# colleges, keeping the diagonal above every other cost.
+def addDiversityCost(cost, encoded):
+    for codes, weight in encoded:
+        cost += weight * ((codes[:, None] == codes[None, :]) & (codes >= 0)[:, None])
+    np.fill_diagonal(cost, 0)
+    np.fill_diagonal(cost, cost.max(initial=0) + 1)
+    return cost
+
+# Returns a pair cost function that adds the diversity cost of students i and j to pairCost(i, j), working it out
+# from their encoded attributes as each pair is asked for instead of storing it for every pair
+def diversePairCost(pairCost, encoded):
+    attributes = [(codes.tolist(), float(weight)) for codes, weight in encoded]
+    def cost(i, j):
+        total = pairCost(i, j)
+        for codes, weight in attributes:
+            if codes[i] == codes[j] and codes[i] >= 0:
+                total += weight
+        return total
+    return cost
+
+# Orders the students by their encoded attributes, the most heavily weighted first, so that dealing them out to
+# groups in turn spreads each year and college over as many groups as possible. Students who share every
+# attribute keep their order.
+def diverseOrder(encoded):
+    keys = [codes for codes, _ in sorted(encoded, key=lambda attribute: attribute[1])]
+    return np.lexsort(keys).tolist()
+
+# Greedily matches each student with an unmatched new partner who shares as few weighted attributes as possible,
+# as a starting matching for maxMatching. Students are bucketed by their encoded attributes, and each one scans
+# the buckets from most to least diverse (the order is worked out once per bucket), so the whole pass stays close
+# to linear in the number of students. Returns a list match where match[v] is v's partner, or -1.
+def diverseGreedyMatch(pairIndex, encoded):
+    n = pairIndex.n
+    weights = [float(weight) for _, weight in encoded]
+    keys = list(zip(*[codes.tolist() for codes, _ in encoded]))
+    buckets = {}
+    for i, key in enumerate(keys):
+        buckets.setdefault(key, {})[i] = None
+
+    def sharedWeight(key, other):
+        return sum([weight for a, b, weight in zip(key, other, weights) if a == b and a >= 0])
+
+    match = [-1] * n
+    orders = {}
+    for v in range(n):
+        if match[v] != -1:
+            continue
+        key = keys[v]
+        del buckets[key][v]
+        if key not in orders:
+            orders[key] = sorted(buckets, key=lambda other: sharedWeight(key, other))
+        for other in orders[key]:
+            partner = next((u for u in buckets[other] if pairIndex.isNew(v, u)), -1)
+            if partner != -1:
+                del buckets[other][partner]
+                match[v], match[partner] = partner, v
+                break
+    return match
+
+# Finds a perfect matching of minimum total cost (leaving one student out if n is odd) for an n x n cost matrix.
+# Large rosters are first given a maximum matching of zero cost (new) pairs, which costs nothing. The students it
+# leaves over only consider their `candidates` cheapest partners among themselves (ties broken at random, so that
+# rows full of equal costs don't all pick the same few students), and any students still left over are matched on
+# their full costs, or greedily if there are more than DENSE_LIMIT of them.
+# Returns a list of (i, j) pairs.
+def minCostPairs(cost, candidates=CANDIDATES, seed=None):
+    n = cost.shape[0]
+    if n % 2 == 1:
+        # Proving that an odd roster has no perfect matching is slow, so leave out the student whose cheapest
+        # partner costs the most and match everyone else
+        cheapest = np.where(np.eye(n, dtype=bool), np.inf, cost).min(axis=1)
+        keep = np.delete(np.arange(n), int(np.argmax(cheapest)))
+        return [(int(keep[i]), int(keep[j])) for i, j in minCostPairs(cost[np.ix_(keep, keep)], candidates, seed)]
+    if n <= DENSE_LIMIT:
+        return _maxWeightPairs(cost, np.arange(n), None)
+
+    free = cost == 0
+    np.fill_diagonal(free, False)
+    match = maxMatching(n, lambda v: np.flatnonzero(free[v]).tolist())
+    pairs = [(i, j) for i, j in enumerate(match) if i < j]
+    left = np.array([i for i, j in enumerate(match) if j == -1], dtype=np.int64)
+
+    if len(left) > DENSE_LIMIT:
+        sub = cost[np.ix_(left, left)]
+        jitter = np.random.default_rng(seed).random(sub.shape, dtype=np.float32) * 1e-3
+        nearest = np.argpartition(sub + jitter, min(candidates, len(left) - 1), axis=1)[:, :candidates + 1]
+        found = _maxWeightPairs(sub, np.arange(len(left)), nearest)
+        pairs.extend((left[i], left[j]) for i, j in found)
+        matched = np.zeros(len(left), dtype=bool)
+        for i, j in found:
+            matched[i] = matched[j] = True
+        left = left[~matched]
+
+    if len(left) > DENSE_LIMIT:
+        pairs.extend(_greedyPairs(cost, left))
+    elif len(left) > 1:
+        pairs.extend((left[i], left[j]) for i, j in _maxWeightPairs(cost[np.ix_(left, left)], np.arange(len(left)), None))
+    return [(int(i), int(j)) for i, j in pairs]
+
+# Pairs each of the students in left, in turn, with the cheapest of the students in left not yet paired
+def _greedyPairs(cost, left):
+    sub = cost[np.ix_(left, left)].astype(np.float64)
+    np.fill_diagonal(sub, np.inf)
+    paired = np.zeros(len(left), dtype=bool)
+    pairs = []
+    for i in range(len(left) - 1):
+        if paired[i]:
+            continue
+        j = int(np.argmin(np.where(paired, np.inf, sub[i])))
+        if paired[j] or j == i:
+            break
+        paired[i] = paired[j] = True
+        pairs.append((left[i], left[j]))
+    return pairs
+
+# Solves the matching as a maximum weight matching of maximum cardinality on weights (largest cost + 1 - cost),
+# over every pair of vertices or only the pairs in each row of nearest.
+def _maxWeightPairs(cost, vertices, nearest):
+    top = float(cost.max(initial=0)) + 1
+    graph = nx.Graph()
+    graph.add_nodes_from(vertices.tolist())
+    if nearest is None:
+        i, j = np.triu_indices(len(vertices), 1)
+    else:
+        i = np.repeat(vertices, nearest.shape[1])
+        j = nearest.ravel()
+        keep = i != j
+        i, j = i[keep], j[keep]
+    # networkx is only exact for integer weights, so keep three decimal places of the costs
+    weights = np.rint((top - cost[i, j]) * 1000).astype(np.int64)
+    graph.add_weighted_edges_from(zip(i.tolist(), j.tolist(), weights.tolist()))
+    return [tuple(sorted(pair)) for pair in nx.max_weight_matching(graph, maxcardinality=True)]
@@ -0,0 +1,72 @@
+from history import normalizeEmail
+
+# Hash index of the roster by email and by case-folded name, built once so that each entry resolves in O(1)
+class RosterIndex:
+    def __init__(self, students):
+        self.byEmail = {normalizeEmail(student.email): student for student in students}
+        self.byName = {}
+        for student in students:
+            self.byName.setdefault(student.name.strip().casefold(), []).append(student)
+
+    # Returns (student, None) for a name or email in the roster, or (None, error message) if it can't be resolved
+    def lookup(self, entry):
+        if '@' in entry:
+            student = self.byEmail.get(normalizeEmail(entry))
+            return (student, None) if student else (None, 'unknown email "{}"'.format(entry))
+        matches = self.byName.get(entry.casefold(), [])
+        if len(matches) == 1:
+            return matches[0], None
+        if len(matches) == 0:
+            return None, 'unknown name "{}"'.format(entry)
+        return None, 'name "{}" is shared by {} students ({}), use an email instead'.format(
+            entry, len(matches), ', '.join([student.email for student in matches]))
+
+# Validates custom groupings in one pass over lines (e.g. an open file), where each line is a comma-separated
+# list of the names or emails of the students in one group. Students must be in exactly one valid group, and groups
+# must have groupSize students, except for one group of groupSize + 1 when the roster doesn't divide evenly.
+# Returns the groups (as lists of Students) and a list of every error found.
+def validateCustomGroupings(lines, students, groupSize):
+    index = RosterIndex(students)
+    groups, errors = [], []
+    placed = {}     # id(student) -> line number of the group they were placed in
+    numLarger = 0
+
+    for lineNum, line in enumerate(lines, start=1):
+        entries = [entry.strip() for entry in line.split(',') if entry.strip()]
+        if len(entries) == 0:
+            continue
+
+        group, inGroup, valid = [], set(), True
+        for entry in entries:
+            student, error = index.lookup(entry)
+            if error:
+                errors.append('Line {}: {}.'.format(lineNum, error))
+                valid = False
+            elif id(student) in inGroup:
+                errors.append('Line {}: {} is already in this group.'.format(lineNum, student.name))
+                valid = False
+            elif id(student) in placed:
+                errors.append('Line {}: {} is already in the group on line {}.'.format(lineNum, student.name, placed[id(student)]))
+                valid = False
+            else:
+                inGroup.add(id(student))
+                group.append(student)
+
+        if len(entries) < groupSize:
+            errors.append('Line {}: groups must have at least {} students, but this one has {}.'.format(lineNum, groupSize, len(entries)))
+            valid = False
+        elif len(entries) > groupSize:
+            numLarger += 1
+            if len(entries) > groupSize + 1 or len(students) % groupSize == 0 or numLarger > 1:
+                errors.append('Line {}: groups must have {} students, but this one has {}.'.format(lineNum, groupSize, len(entries)))
+                valid = False
+        # Only a group that is valid as a whole places its students, so a rejected line doesn't hide them
+        if valid:
+            for student in group:
+                placed[id(student)] = lineNum
+            groups.append(group)
+
+    missing = [student.name for student in students if id(student) not in placed]
+    if len(missing) > 0:
+        errors.append('{} student{} not in any group: {}.'.format(len(missing), ' is' if len(missing) == 1 else 's are', ', '.join(missing)))
+    return groups, errors
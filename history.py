@@ -0,0 +1,188 @@
+from itertools import combinations
+
+import numpy as np
+
+AMBIGUOUS = -1
+
+def normalizeEmail(email):
+    return email.strip().casefold()
+
+# Interns students to small integer ids (their position in the list), keyed on email.
+# Names are only used to resolve old history rows that were saved without emails; a name shared
+# by more than one student is ambiguous and is never resolved.
+class StudentIds:
+    def __init__(self, students):
+        self.students = list(students)
+        self.byEmail = {}
+        self.byName = {}
+        for i, student in enumerate(self.students):
+            self.byEmail[normalizeEmail(student.email)] = i
+            self.byName[student.name] = AMBIGUOUS if student.name in self.byName else i
+
+    def __len__(self):
+        return len(self.students)
+
+    # Returns the id of a student in a history row, or AMBIGUOUS if they aren't in the current roster
+    def resolveOne(self, name, email=''):
+        if email:
+            return self.byEmail.get(normalizeEmail(email), AMBIGUOUS)
+        return self.byName.get(name, AMBIGUOUS)
+
+    # Returns the ids of the students in a history row that are in the current roster
+    def resolve(self, names, emails=()):
+        if emails and len(emails) == len(names):
+            ids = [self.byEmail.get(normalizeEmail(email), AMBIGUOUS) for email in emails]
+        else:
+            ids = [self.byName.get(name, AMBIGUOUS) for name in names]
+        return [i for i in ids if i != AMBIGUOUS]
+
+# Number of times each pair of students has been grouped together, stored as a packed lower
+# triangular array of saturating byte counters (n * (n - 1) / 2 bytes for n students).
+class PairIndex:
+    def __init__(self, n):
+        self.n = n
+        self.totalPairs = n * (n - 1) // 2
+        self.counts = bytearray(self.totalPairs)
+
+    def offset(self, i, j):
+        if i < j:
+            i, j = j, i
+        return i * (i - 1) // 2 + j
+
+    def add(self, i, j, times=1):
+        k = self.offset(i, j)
+        self.counts[k] = min(255, self.counts[k] + times)
+
+    def addGroup(self, ids):
+        for i, j in combinations(ids, 2):
+            if i != j:
+                self.add(i, j)
+
+    def count(self, i, j):
+        return self.counts[self.offset(i, j)]
+
+    def isNew(self, i, j):
+        return self.counts[self.offset(i, j)] == 0
+
+    def isNewGroup(self, ids):
+        return all(self.isNew(i, j) for i, j in combinations(ids, 2))
+
+    def newPairs(self):
+        return self.counts.count(0)
+
+    # Yields every student that i has never been grouped with, starting just after i so that a greedy
+    # pass over the students in order finds a free partner quickly.
+    def newPartners(self, i):
+        counts = self.counts
+        base = i * (i - 1) // 2
+        for j in range(i + 1, self.n):
+            if counts[j * (j - 1) // 2 + i] == 0:
+                yield j
+        for j in range(i):
+            if counts[base + j] == 0:
+                yield j
+
+    # Returns the pairs that have been grouped before as arrays of i, j (with i < j) and the times they were grouped,
+    # finding them with one vectorized scan of the packed counts
+    def pairs(self):
+        counts = np.frombuffer(self.counts, dtype=np.uint8)
+        k = np.flatnonzero(counts)
+        # Offset k holds the pair (i, j) with i < j and k = j * (j - 1) / 2 + i
+        j = ((1 + np.sqrt(1 + 8 * k.astype(np.float64))) // 2).astype(np.int64)
+        j -= (j * (j - 1) // 2 > k)
+        return k - j * (j - 1) // 2, j, counts[k]
+
+# The same as PairIndex, but only keeping the pairs that have been grouped before, in a dict. It takes memory and
+# time proportional to the history instead of n * n, for rosters so large that most pairs have never met.
+class SparsePairIndex:
+    def __init__(self, n):
+        self.n = n
+        self.totalPairs = n * (n - 1) // 2
+        self.counts = {}
+
+    def add(self, i, j, times=1):
+        key = (i, j) if i < j else (j, i)
+        self.counts[key] = min(255, self.counts.get(key, 0) + times)
+
+    def addGroup(self, ids):
+        for i, j in combinations(ids, 2):
+            if i != j:
+                self.add(i, j)
+
+    def count(self, i, j):
+        return self.counts.get((i, j) if i < j else (j, i), 0)
+
+    def isNew(self, i, j):
+        return self.count(i, j) == 0
+
+    def isNewGroup(self, ids):
+        return all(self.isNew(i, j) for i, j in combinations(ids, 2))
+
+    def newPairs(self):
+        return self.totalPairs - len(self.counts)
+
+    def newPartners(self, i):
+        for j in range(i + 1, self.n):
+            if (i, j) not in self.counts:
+                yield j
+        for j in range(i):
+            if (j, i) not in self.counts:
+                yield j
+
+    def pairs(self):
+        if len(self.counts) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        ij = np.array(list(self.counts.keys()), dtype=np.int64)
+        return ij[:, 0], ij[:, 1], np.fromiter(self.counts.values(), dtype=np.uint8, count=len(self.counts))
+
+# Builds the student ids and the pair index for students from the rows returned by getPrevGroups, or from
+# already counted pairs (as returned by GroupStore.pairCounts) if given. With sparse, the index is a SparsePairIndex.
+def buildPairIndex(students, prevGroups, pairCounts=None, sparse=False):
+    ids = StudentIds(students)
+    index = (SparsePairIndex if sparse else PairIndex)(len(ids))
+    if pairCounts is not None:
+        for nameA, emailA, nameB, emailB, times in pairCounts:
+            i, j = ids.resolveOne(nameA, emailA), ids.resolveOne(nameB, emailB)
+            if i != AMBIGUOUS and j != AMBIGUOUS and i != j:
+                index.add(i, j, times)
+        return ids, index
+    for row in prevGroups:
+        index.addGroup(ids.resolve(row[1], row[2]))
+    return ids, index
+
+# Looks up how many times students in the roster have been grouped together in a GroupStore, reading only the
+# history of the students asked about. Students are matched on email, and on name (if no one else in the roster
+# shares it) for old rows saved without emails, the same way as StudentIds. Each student's partners are only
+# fetched from the store once.
+class HistoryLookup:
+    def __init__(self, students, store, sheetId):
+        self.ids = StudentIds(students)
+        self.store = store
+        self.sheetId = sheetId
+        self.partners = {}
+
+    # Returns the name of the student with email if it identifies them, or None
+    def uniqueName(self, email):
+        i = self.ids.byEmail.get(email, AMBIGUOUS)
+        if i == AMBIGUOUS:
+            return None
+        name = self.ids.students[i].name
+        return name if self.ids.byName.get(name) == i else None
+
+    # Returns how many times the students with emails a and b have been grouped, from all of a's partners
+    def timesMet(self, a, b):
+        if a not in self.partners:
+            counts = {}
+            for partner, times in self.store.partnerCounts(self.sheetId, a, self.uniqueName(a)).items():
+                if partner.startswith('name:'):
+                    j = self.ids.byName.get(partner[len('name:'):], AMBIGUOUS)
+                    if j == AMBIGUOUS:
+                        continue
+                    partner = normalizeEmail(self.ids.students[j].email)
+                counts[partner] = counts.get(partner, 0) + times
+            self.partners[a] = counts
+        return self.partners[a].get(b, 0)
+
+    # Returns how many times the students with emails a and b have been grouped, looking up just that pair
+    def pairTimes(self, a, b):
+        return self.store.pairTimes(self.sheetId, a, b, self.uniqueName(a), self.uniqueName(b))
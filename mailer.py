@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httplib2
+from tqdm import tqdm
+from apiclient import errors
+
+import metrics
+from services import getService
+
+# Gmail allows 250 quota units per user per second and messages.send costs 100 units, so sustain 2.5 sends
+# per second with short bursts on top.
+SEND_WORKERS        = 8
+SEND_RATE           = 2.5
+SEND_BURST          = 10
+BATCH_SIZE          = 50    # Gmail accepts up to 100 calls per batch but recommends no more than 50
+MAX_RETRIES         = 5
+BACKOFF_BASE        = 1.0   # seconds
+RETRYABLE_STATUSES  = {429, 500, 502, 503, 504}
+RETRYABLE_REASONS   = ('rateLimitExceeded', 'userRateLimitExceeded', 'backendError')
+
+# Thread-safe token bucket that lets through `rate` calls per second on average and up to `capacity` at once
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def isRetryable(error):
+    if isinstance(error, errors.HttpError):
+        if error.resp.status in RETRYABLE_STATUSES:
+            return True
+        content = error.content.decode(errors='replace') if isinstance(error.content, bytes) else str(error.content)
+        return error.resp.status == 403 and any(reason in content for reason in RETRYABLE_REASONS)
+    # Dropped connections and timeouts
+    return isinstance(error, (httplib2.HttpLib2Error, OSError))
+
+# Calls send() once the bucket allows it, retrying retryable errors with exponential backoff and jitter.
+# Returns (result, None) on success or (None, error) once the error isn't retryable or retries run out.
+def sendWithRetry(send, bucket, retries=MAX_RETRIES, backoff=BACKOFF_BASE):
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        try:
+            with metrics.api('gmail.messages.send', retry=attempt > 0):
+                return send(), None
+        except Exception as error:
+            if attempt == retries or not isRetryable(error):
+                return None, error
+            time.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+
+# Sends every message body (as built by createMessage) from a bounded pool of threads, each with its own Gmail
+# client since the underlying HTTP connections can't be shared between threads. onResult(i, result, error), if
+# given, is called from the calling thread as soon as each message is sent or gives up.
+# Returns a list of (result, error) in the same order as messages.
+def sendConcurrently(messages, credentials, workers=SEND_WORKERS, rate=SEND_RATE, burst=SEND_BURST, desc='Sending emails', onResult=None):
+    bucket = TokenBucket(rate, burst)
+
+    def send(message):
+        service = getService('gmail', 'v1', credentials)
+        return sendWithRetry(lambda: service.users().messages().send(userId='me', body=message).execute(), bucket)
+
+    results = [None] * len(messages)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(messages)))) as pool:
+        futures = {pool.submit(send, message): i for i, message in enumerate(messages)}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            i = futures[future]
+            results[i] = future.result()
+            if onResult:
+                onResult(i, *results[i])
+    return results
+
+# Sends the message bodies in multipart batch requests of up to batchSize calls each, mapping each part's response
+# back to its message. Parts that fail with a retryable error are re-queued into later batches with exponential
+# backoff; every other part is sent only once. onResult(i, result, error), if given, is called as soon as each
+# message is sent or gives up.
+# Returns a list of (result, error) in the same order as messages.
+def sendBatched(messages, credentials, batchSize=BATCH_SIZE, rate=SEND_RATE, burst=SEND_BURST, retries=MAX_RETRIES, backoff=BACKOFF_BASE, desc='Sending emails', onResult=None):
+    bucket = TokenBucket(rate, burst)
+    service = getService('gmail', 'v1', credentials)
+    results = [None] * len(messages)
+    pending = list(range(len(messages)))
+    progress = tqdm(total=len(messages), desc=desc)
+
+    for attempt in range(retries + 1):
+        requeue = set()
+
+        def callback(requestId, response, exception):
+            i = int(requestId)
+            metrics.count('gmail.batch.parts')
+            if exception is None:
+                results[i] = (response, None)
+            elif attempt < retries and isRetryable(exception):
+                metrics.count('gmail.batch.part_errors')
+                requeue.add(i)
+                return
+            else:
+                metrics.count('gmail.batch.part_errors')
+                results[i] = (None, exception)
+            if onResult:
+                onResult(i, *results[i])
+            progress.update(1)
+
+        for start in range(0, len(pending), batchSize):
+            batch = service.new_batch_http_request(callback=callback)
+            for i in pending[start:start + batchSize]:
+                # Each part of a batch still counts against the sending quota
+                bucket.acquire()
+                batch.add(service.users().messages().send(userId='me', body=messages[i]), request_id=str(i))
+            try:
+                with metrics.api('gmail.batch', retry=attempt > 0):
+                    batch.execute()
+            except Exception as error:
+                # The whole batch failed before any part was answered
+                for i in pending[start:start + batchSize]:
+                    if results[i] is None and i not in requeue:
+                        callback(str(i), None, error)
+
+        if len(requeue) == 0:
+            break
+        metrics.count('gmail.batch.requeued', len(requeue))
+        pending = sorted(requeue)
+        time.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+
+    progress.close()
+    return results
+
+# Sends the message bodies in batches of batchSize, or one request per message from a thread pool if batchSize is 0
+def sendMessages(messages, credentials, workers=SEND_WORKERS, rate=SEND_RATE, batchSize=BATCH_SIZE, onResult=None):
+    if batchSize > 0:
+        return sendBatched(messages, credentials, batchSize, rate, onResult=onResult)
+    return sendConcurrently(messages, credentials, workers, rate, onResult=onResult)
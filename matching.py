@@ -0,0 +1,170 @@
+import math
+import random
+import time
+from collections import deque
+
+# Finds a maximum cardinality matching in a general (non-bipartite) graph using Edmonds' blossom algorithm.
+# n is the number of vertices and neighbors(v) returns an iterable of the vertices adjacent to v.
+# Starts from the matching start (in the same form as the result) if given, or else from a greedy matching.
+# Returns a list match where match[v] is the vertex matched with v, or -1 if v is unmatched.
+# EX. n = 4; edges 0-1, 1-2, 2-3. Returns [1, 0, 3, 2]
+def maxMatching(n, neighbors, start=None):
+    match = list(start) if start is not None else [-1] * n
+
+    # Start from a greedy matching so that only a few augmenting paths are left to find
+    for v in range(n if start is None else 0):
+        if match[v] != -1:
+            continue
+        for u in neighbors(v):
+            if u != v and match[u] == -1:
+                match[v], match[u] = u, v
+                break
+
+    # Grow the matching along augmenting paths from every free vertex
+    for root in range(n):
+        if match[root] != -1:
+            continue
+        end, parent = _findAugmentingPath(root, n, neighbors, match)
+        while end != -1:
+            prev = parent[end]
+            nxt = match[prev]
+            match[end], match[prev] = prev, end
+            end = nxt
+
+    return match
+
+# Breadth-first search for an augmenting path from root, contracting odd cycles (blossoms) as they are found.
+# Returns the free vertex at the end of the path (or -1 if there is none) and the parent links to walk it back.
+def _findAugmentingPath(root, n, neighbors, match):
+    used = [False] * n
+    parent = [-1] * n
+    base = list(range(n))
+
+    used[root] = True
+    queue = deque([root])
+    while queue:
+        v = queue.popleft()
+        for u in neighbors(v):
+            if u == v or base[v] == base[u] or match[v] == u:
+                continue
+            if u == root or (match[u] != -1 and parent[match[u]] != -1):
+                # Found an odd cycle: contract it into a single blossom with base curBase
+                curBase = _lowestCommonAncestor(v, u, n, base, match, parent)
+                blossom = [False] * n
+                _markPath(v, curBase, u, base, match, parent, blossom)
+                _markPath(u, curBase, v, base, match, parent, blossom)
+                for i in range(n):
+                    if blossom[base[i]]:
+                        base[i] = curBase
+                        if not used[i]:
+                            used[i] = True
+                            queue.append(i)
+            elif parent[u] == -1:
+                parent[u] = v
+                if match[u] == -1:
+                    return u, parent
+                used[match[u]] = True
+                queue.append(match[u])
+    return -1, parent
+
+def _lowestCommonAncestor(a, b, n, base, match, parent):
+    seen = [False] * n
+    while True:
+        a = base[a]
+        seen[a] = True
+        if match[a] == -1:
+            break
+        a = parent[match[a]]
+    while True:
+        b = base[b]
+        if seen[b]:
+            return b
+        b = parent[match[b]]
+
+def _markPath(v, b, child, base, match, parent, blossom):
+    while base[v] != b:
+        blossom[base[v]] = blossom[base[match[v]]] = True
+        parent[v] = child
+        child = match[v]
+        v = parent[match[v]]
+
+# Splits n students into groups of k that minimize the total pair cost, using simulated annealing on swaps of
+# two students in different groups. If k does not divide n, there are ceil(n / k) groups whose sizes differ by at
+# most one, so no group is larger than k and none is smaller than k - 1 unless there are too few students to fill
+# them (e.g. 5 students in groups of 4 makes groups of 3 and 2). pairCost(i, j) returns the cost of grouping
+# students i and j together (e.g. how many times they have been grouped before). The students are dealt out to
+# the groups in turn, in the given order if any (e.g. sorted by an attribute, so that each group starts out mixed).
+# Stops once no group has any cost or after timeBudget seconds.
+# Returns the groups (as lists of student ids), their total cost, and the number of swaps tried.
+def localSearchGroups(n, k, pairCost, timeBudget=5.0, seed=None, order=None):
+    rng = random.Random(seed)
+    numGroups = max(1, math.ceil(n / k))
+    order = list(range(n)) if order is None else list(order)
+    groups = [order[g::numGroups] for g in range(numGroups)]
+    groupOf = [0] * n
+    for g, grp in enumerate(groups):
+        for i in grp:
+            groupOf[i] = g
+
+    def memberCost(i, g, skip):
+        return sum(pairCost(i, j) for j in groups[g] if j != i and j != skip)
+
+    groupCosts = [sum(pairCost(i, j) for a, i in enumerate(grp) for j in grp[a+1:]) for grp in groups]
+    totalCost = sum(groupCosts)
+    best, bestCost = [list(grp) for grp in groups], totalCost
+
+    # Groups with a repeat in them, kept in a list with positions so that they can be sampled and removed in O(1)
+    hot, hotPos = [], {}
+    def updateHot(g):
+        if groupCosts[g] > 0 and g not in hotPos:
+            hotPos[g] = len(hot)
+            hot.append(g)
+        elif groupCosts[g] == 0 and g in hotPos:
+            last = hot.pop()
+            pos = hotPos.pop(g)
+            if last != g:
+                hot[pos] = last
+                hotPos[last] = pos
+    for g in range(numGroups):
+        updateHot(g)
+
+    start = time.perf_counter()
+    temperature = 1.0
+    iterations = 0
+    while hot and numGroups > 1:
+        iterations += 1
+        if iterations % 256 == 0:
+            elapsed = time.perf_counter() - start
+            if elapsed >= timeBudget:
+                break
+            temperature = max(1e-3, 1.0 - elapsed / timeBudget)
+
+        # Swap a student out of a group with a repeat with a random student in another group
+        g1 = hot[rng.randrange(len(hot))]
+        a = groups[g1][rng.randrange(len(groups[g1]))]
+        b = rng.randrange(n)
+        g2 = groupOf[b]
+        if g2 == g1:
+            continue
+        oldA, newA = memberCost(a, g1, a), memberCost(a, g2, b)
+        oldB, newB = memberCost(b, g2, b), memberCost(b, g1, a)
+        delta = newA + newB - oldA - oldB
+        if delta > 0:
+            if rng.random() >= math.exp(-delta / temperature):
+                continue
+            # Remember the best grouping seen before moving uphill
+            if totalCost < bestCost:
+                best, bestCost = [list(grp) for grp in groups], totalCost
+
+        groups[g1][groups[g1].index(a)] = b
+        groups[g2][groups[g2].index(b)] = a
+        groupOf[a], groupOf[b] = g2, g1
+        groupCosts[g1] += newB - oldA
+        groupCosts[g2] += newA - oldB
+        totalCost += delta
+        updateHot(g1)
+        updateHot(g2)
+
+    if totalCost <= bestCost:
+        return groups, totalCost, iterations
+    return best, bestCost, iterations
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Lightweight run instrumentation: nested timing spans, per-API-call latency and retry counts, and counters.
+# Everything is a no-op until enable() is called, so instrumented code costs next to nothing by default.
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_spans = {}
+_apis = {}
+_counters = {}
+_noop = nullcontext()
+
+def enable():
+    global _enabled
+    _enabled = True
+    reset()
+
+def enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _apis.clear()
+        _counters.clear()
+
+@contextmanager
+def _span(name):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(name)
+    path = '/'.join(stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            entry = _spans.setdefault(path, {'calls': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+
+# Times a phase of the run. Spans opened inside another span are recorded under its path (e.g. 'mealBot/getStudents').
+def span(name):
+    if not _enabled:
+        return _noop
+    return _span(name)
+
+# Decorator that times every call of a function as a span named after the function
+def timed(function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        with _span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+# Records one call to a Google API: how long it took, and whether it was a retry or failed
+def apiCall(name, seconds, retry=False, error=False):
+    if not _enabled:
+        return
+    with _lock:
+        entry = _apis.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'retries': 0, 'errors': 0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        entry['max_seconds'] = max(entry['max_seconds'], seconds)
+        entry['retries'] += int(retry)
+        entry['errors'] += int(error)
+
+# Context manager that times a Google API call, counting it as an error if it raises
+@contextmanager
+def _apiTimer(name, retry):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        apiCall(name, time.perf_counter() - start, retry, error=True)
+        raise
+    apiCall(name, time.perf_counter() - start, retry)
+
+def api(name, retry=False):
+    if not _enabled:
+        return _noop
+    return _apiTimer(name, retry)
+
+def report():
+    with _lock:
+        return {
+            'spans': {path: dict(entry, seconds=round(entry['seconds'], 6)) for path, entry in _spans.items()},
+            'apis': {name: dict(entry, seconds=round(entry['seconds'], 6), max_seconds=round(entry['max_seconds'], 6)) for name, entry in _apis.items()},
+            'counters': dict(_counters),
+        }
+
+def print_report(data):
+    print('\nMetrics:')
+    print('\tSpans:')
+    for path, entry in sorted(data['spans'].items()):
+        print('\t\t{}{}: {:.3f}s ({} calls)'.format('  ' * path.count('/'), path.rsplit('/', 1)[-1], entry['seconds'], entry['calls']))
+    print('\tAPI calls:')
+    for name, entry in data['apis'].items():
+        print('\t\t{}: {} calls, {:.3f}s total, {:.3f}s max, {} retries, {} errors'.format(
+            name, entry['calls'], entry['seconds'], entry['max_seconds'], entry['retries'], entry['errors']))
+    print('\tCounters:')
+    for name, value in data['counters'].items():
+        print('\t\t{}: {}'.format(name, value))
+
+# Writes the metrics as JSON to filename, or prints a summary if filename is '-'
+def write(filename):
+    data = report()
+    if filename == '-':
+        print_report(data)
+        return
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=2)
@@ -0,0 +1,93 @@
+import json
+import os
+from datetime import datetime
+
+from utils import atomicWrite
+
+OUTBOX_DIR = 'outbox'
+
+# An outbox is an append-only spool of one round of emails, written before any of them is sent so that a run that
+# stops halfway can pick up exactly where it left off. Each line is one JSON record:
+#   {"type": "header", "week": ..., "subject": ..., "created": ..., "scheduled": bool}
+#   {"type": "message", "id": 0, "row": [week, names, emails], "payload": {"raw": ...}}   (one per group)
+#       with "replaces": [week, names, emails] when the group is a repaired version of a row already saved
+#   {"type": "status", "id": 0, "status": "sent" or "failed", "error": ...}               (appended as sends finish)
+#   {"type": "committed"}                                                                  (once the groups are saved)
+# The latest status of a message wins, so failed messages can be retried by appending another status.
+class Outbox:
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.messages = []
+        self.status = {}
+        self.errors = {}
+        self.committed = False
+
+    # Reads the spool at path, or returns None if there isn't one. A line cut off by a crash is ignored.
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        outbox = cls(path)
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                outbox._apply(record)
+        return outbox if outbox.header is not None else None
+
+    # Writes a new spool with the header and every message, replacing any committed spool at path. replaces has the
+    # row each message's group replaces, or None, if given.
+    @classmethod
+    def create(cls, path, header, messages, replaces=None):
+        outbox = cls(path)
+        records = [dict(header, type='header', created=datetime.now().isoformat(timespec='seconds'))]
+        replaces = replaces or [None] * len(messages)
+        for i, ((row, payload), replaced) in enumerate(zip(messages, replaces)):
+            records.append({'type': 'message', 'id': i, 'row': row, 'payload': payload})
+            if replaced is not None:
+                records[-1]['replaces'] = replaced
+        atomicWrite(path, lambda f: f.writelines(json.dumps(record) + '\n' for record in records), sync=True)
+        for record in records:
+            outbox._apply(record)
+        return outbox
+
+    def _apply(self, record):
+        if record['type'] == 'header':
+            self.header = record
+        elif record['type'] == 'message':
+            self.messages.append(record)
+        elif record['type'] == 'status':
+            self.status[record['id']] = record['status']
+            self.errors[record['id']] = record.get('error')
+        elif record['type'] == 'committed':
+            self.committed = True
+
+    # Appends a record and waits for it to reach the disk, so that nothing marked sent is ever sent again
+    def _append(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(record)
+
+    def mark(self, i, status, error=None):
+        self._append({'type': 'status', 'id': i, 'status': status, 'error': None if error is None else str(error)})
+
+    def commit(self):
+        self._append({'type': 'committed'})
+
+    # Returns the messages that haven't been sent yet, including ones that failed
+    def pending(self):
+        return [message for message in self.messages if self.status.get(message['id']) != 'sent']
+
+    def failed(self):
+        return [message for message in self.messages if self.status.get(message['id']) == 'failed']
+
+    def numSent(self):
+        return len(self.messages) - len(self.pending())
+
+def outboxFile(sheetId, directory=OUTBOX_DIR):
+    return os.path.join(directory, '{}.jsonl'.format(sheetId))
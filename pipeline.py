@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+
+import metrics
+
+LOG_DIR = 'logs'
+
+def getCohorts(filename):
+    print('Reading cohorts file...', end='')
+    with open(filename, 'r') as cohortsFile:
+        cohorts = json.load(cohortsFile)
+    names = [cohort.get('name') for cohort in cohorts]
+    if None in names or len(set(names)) != len(names):
+        print('Failed')
+        raise ValueError('Every cohort in {} must have a unique "name".'.format(filename))
+    print('Done ({} cohorts)'.format(len(cohorts)))
+    return cohorts
+
+# Runs one cohort's fetch -> group -> send -> save pipeline with the cohort's config applied over args, writing
+# everything it prints to the cohort's log file. Returns the summary from mealBot.
+def runCohort(args, cohort):
+    # MealBot imports this module, so import it here rather than at the top
+    import MealBot
+
+    cohortArgs = argparse.Namespace(**vars(args))
+    for key, value in cohort.items():
+        if key != 'name':
+            setattr(cohortArgs, key, value)
+    cohortArgs.cohorts = None
+    if cohortArgs.metrics and cohortArgs.metrics != '-':
+        base, ext = os.path.splitext(cohortArgs.metrics)
+        cohortArgs.metrics = '{}_{}{}'.format(base, cohort['name'], ext or '.json')
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logFile = os.path.join(LOG_DIR, '{}.log'.format(cohort['name']))
+    with open(logFile, 'w') as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            if cohortArgs.custom_groupings:
+                raise ValueError('Custom groupings need a prompt, so they can\'t be used with --cohorts.')
+            if not (cohortArgs.yes or cohortArgs.dry_run):
+                raise ValueError('Cohorts run without prompts, so they need --yes or --dry-run.')
+            MealBot.checkArgs(cohortArgs)
+            if cohortArgs.metrics:
+                metrics.enable()
+            summary = MealBot.mealBot(cohortArgs) or {}
+            if cohortArgs.metrics:
+                metrics.write(cohortArgs.metrics)
+        except (Exception, SystemExit) as error:
+            traceback.print_exc()
+            summary = {'status': 'error: {}'.format(error)}
+    summary['name'] = cohort['name']
+    summary['log'] = logFile
+    return summary
+
+def print_summary(summaries):
+    print('\nCohort summary [{}]:'.format(len(summaries)))
+    for summary in summaries:
+        print('\t{}: {} students, {} groups, {} emailed, {} failed - {} ({})'.format(
+            summary['name'], summary.get('students', 0), summary.get('groups', 0), summary.get('emailed', 0),
+            summary.get('failed', 0), summary.get('status', 'unknown'), summary['log']))
+
+# Runs every cohort in its own worker process and prints one combined summary. Returns the summaries in the same
+# order as cohorts.
+def runCohorts(args, cohorts, workers=None):
+    import MealBot
+
+    # Sign in once up front, so that any browser sign-in happens here instead of in a worker
+    ids = MealBot.getIds(args.ids_file)
+    MealBot.getCredentials(MealBot.CREDENTIALS_FILE, MealBot.TOKEN_FILE, ids["APPLICATION_NAME"])
+
+    print('\nRunning {} cohorts{}...'.format(len(cohorts), ' (dry run)' if args.dry_run else ''))
+    summaries = [None] * len(cohorts)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(runCohort, args, cohort): i for i, cohort in enumerate(cohorts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            summaries[i] = future.result()
+            print('\t{}...Done'.format(cohorts[i]['name']))
+
+    print_summary(summaries)
+    return summaries
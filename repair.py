@@ -0,0 +1,65 @@
+from matching import maxMatching, localSearchGroups
+
+REPAIR_TIME_BUDGET = 1.0   # seconds
+
+# Repairs a grouping (a list of groups of emails) after the students in removed drop out and the students in added
+# join, leaving every group that isn't affected alone. Groups that lose a member but still have groupSize students
+# are kept; the rest of the members of broken groups are re-grouped with the added students, preferring students
+# who have never met. A student who can't make a group joins one of the smallest groups, an affected one if there
+# is one that small. timesMet(a, b) returns how many times two students have been
+# grouped before. All of the work is on the affected students, so it takes time proportional to the change.
+# Returns the unchanged groups, the changed groups, and for each changed group the original group it is a new
+# version of (or None for a new group), so that saving it can replace the original instead of adding to it.
+def repairGroups(groups, removed, added, groupSize, timesMet, timeBudget=REPAIR_TIME_BUDGET):
+    removed = set(removed)
+    unchanged, changed, unpaired = [], [], [email for email in added if email not in removed]
+    for grp in groups:
+        left = [email for email in grp if email not in removed]
+        if len(left) == len(grp):
+            unchanged.append(grp)
+        elif len(left) >= groupSize:
+            changed.append((left, grp))
+        else:
+            unpaired.extend(left)
+
+    newGroups, leftover = groupUnpaired(unpaired, groupSize, timesMet, timeBudget)
+    changed.extend((grp, None) for grp in newGroups)
+
+    # Put each student left over into one of the smallest groups, preferring an affected group and then the group
+    # they have met least, so that leftovers are spread over different groups
+    for email in leftover:
+        candidates = [(grp, origin, False) for grp, origin in changed] + [(grp, grp, True) for grp in unchanged]
+        if len(candidates) == 0:
+            changed.append(([email], None))
+            continue
+        grp, origin, wasUnchanged = min(candidates, key=lambda c: (len(c[0]), c[2], sum([timesMet(email, other) for other in c[0]])))
+        if wasUnchanged:
+            unchanged.remove(grp)
+        else:
+            changed.remove((grp, origin))
+        changed.append((grp + [email], origin))
+    return unchanged, [grp for grp, _ in changed], [origin for _, origin in changed]
+
+# Groups the unpaired students into groups of groupSize: a maximum matching of new pairs for pairs (with any
+# students left over paired with their least met partners), or a local search for larger groups (which makes the
+# groups as even as possible without going over groupSize when it doesn't divide the number of students).
+# Returns the groups and the students that couldn't make a full group.
+def groupUnpaired(unpaired, groupSize, timesMet, timeBudget=REPAIR_TIME_BUDGET):
+    n = len(unpaired)
+    if n < max(2, groupSize - 1):
+        return [], list(unpaired)
+    if groupSize > 2:
+        idGroups, _, _ = localSearchGroups(n, groupSize, lambda i, j: timesMet(unpaired[i], unpaired[j]), timeBudget)
+        return [[unpaired[i] for i in grp] for grp in idGroups], []
+
+    def newPartners(i):
+        return [j for j in range(n) if j != i and timesMet(unpaired[i], unpaired[j]) == 0]
+    match = maxMatching(n, newPartners)
+    groups = [[unpaired[i], unpaired[j]] for i, j in enumerate(match) if i < j]
+    rest = [unpaired[i] for i, j in enumerate(match) if j == -1]
+    while len(rest) > 1:
+        a = rest.pop()
+        b = min(rest, key=lambda other: timesMet(a, other))
+        rest.remove(b)
+        groups.append([a, b])
+    return groups, rest
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+
+import metrics
+from history import normalizeEmail
+from utils import atomicWrite
+
+RESPONSES_CACHE_DIR = 'responses_cache'
+PAGE_SIZE           = 5000  # the largest page the Forms API returns
+
+# Lists every response to the form matching filter, following nextPageToken until the last page
+def listResponses(service, formId, filter=None):
+    responses, pageToken = [], None
+    while True:
+        params = {'formId': formId, 'pageSize': PAGE_SIZE}
+        if filter:
+            params['filter'] = filter
+        if pageToken:
+            params['pageToken'] = pageToken
+        with metrics.api('forms.responses.list'):
+            result = service.forms().responses().list(**params).execute()
+        responses.extend(result.get('responses', []))
+        pageToken = result.get('nextPageToken')
+        if not pageToken:
+            return responses
+
+# Each form's responses are cached in their own file so that cohorts with different forms never write to the same file
+def cacheFileFor(cacheDir, formId):
+    return os.path.join(cacheDir, '{}.json'.format(formId))
+
+def loadResponseCache(cacheFile):
+    if not os.path.exists(cacheFile):
+        return {'syncedAt': None, 'responses': {}}
+    with open(cacheFile, 'r') as f:
+        return json.load(f)
+
+def saveResponseCache(cacheFile, formCache):
+    atomicWrite(cacheFile, lambda f: json.dump(formCache, f))
+
+# Returns every response to the form, keeping a local cache keyed by responseId. Only responses submitted or
+# edited since the last sync are downloaded and merged into the cache (the newest lastSubmittedTime wins).
+# Deleted responses are only dropped from the cache with refresh=True, which downloads everything again.
+# Returns the responses and how many were downloaded.
+def fetchResponses(service, formId, cacheDir=RESPONSES_CACHE_DIR, refresh=False):
+    cacheFile = cacheFileFor(cacheDir, formId)
+    formCache = {'syncedAt': None, 'responses': {}} if refresh else loadResponseCache(cacheFile)
+    cached = formCache['responses']
+
+    # Timestamps are compared with >= so that responses submitted in the same instant as the last sync aren't missed
+    filter = 'timestamp >= {}'.format(formCache['syncedAt']) if formCache['syncedAt'] else None
+    fetched = listResponses(service, formId, filter)
+    for response in fetched:
+        old = cached.get(response['responseId'])
+        if old is None or old.get('lastSubmittedTime', '') <= response.get('lastSubmittedTime', ''):
+            cached[response['responseId']] = response
+
+    # Use the server's timestamps as the watermark so that the local clock never matters
+    times = [response['lastSubmittedTime'] for response in cached.values() if 'lastSubmittedTime' in response]
+    formCache['syncedAt'] = max(times) if times else None
+    saveResponseCache(cacheFile, formCache)
+    return list(cached.values()), len(fetched)
+
+# ------------- ROSTER PIPELINE -------------
+# Responses flow through generator stages, each one a single pass that counts what it drops in drops[stage]:
+#   parseResponses -> normalizeEntries -> latestPerEmail -> filterEntries
+# Entries are dicts with the keys of a Student plus 'optedOut' and 'submitted' (the response's lastSubmittedTime).
+
+EMAIL = re.compile(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$')
+DOMAIN = re.compile(r'^\*?@(\*\.)?[a-zA-Z0-9-]+(\.[a-zA-Z0-9-]+)*$')
+
+def _drop(drops, stage, n=1):
+    drops[stage] = drops.get(stage, 0) + n
+    metrics.count('roster.dropped.{}'.format(stage), n)
+
+def _answer(response, qid):
+    return response['answers'][qid]['textAnswers']['answers'][0]['value']
+
+# Turns form responses into entries, dropping responses without an email or a required answer
+def parseResponses(responses, ids, drops):
+    for response in responses:
+        try:
+            answers = response.get('answers', {})
+            optedOut = ids["OPT_IN_QID"] in answers and _answer(response, ids["OPT_IN_QID"]) == ids["OPT_IN_NO"]
+            entry = {'email': response['respondentEmail'], 'optedOut': optedOut,
+                     'submitted': response.get('lastSubmittedTime', '')}
+            if not optedOut:
+                entry.update({
+                    'firstname': _answer(response, ids["FIRST_NAME_QID"]),
+                    'lastname': _answer(response, ids["LAST_NAME_QID"]),
+                    'year': _answer(response, ids["YEAR_QID"]),
+                    'college': _answer(response, ids["COLLEGE_QID"]),
+                })
+        except (KeyError, IndexError):
+            _drop(drops, 'incomplete')
+            continue
+        yield entry
+
+# Case-folds emails and trims names (collapsing runs of whitespace), dropping entries whose email isn't valid
+def normalizeEntries(entries, drops):
+    for entry in entries:
+        entry['email'] = normalizeEmail(entry['email'])
+        if not EMAIL.match(entry['email']):
+            _drop(drops, 'invalid_email')
+            continue
+        for key in ('firstname', 'lastname', 'year', 'college'):
+            if key in entry:
+                entry[key] = ' '.join(entry[key].split())
+        yield entry
+
+# Keeps only the latest submission for each email, so that a student who signed up twice, or opted out after opting
+# in, is counted once with their latest answer. Entries come out in the order of their latest submission.
+def latestPerEmail(entries, drops):
+    latest = {}
+    for entry in entries:
+        old = latest.get(entry['email'])
+        if old is not None:
+            _drop(drops, 'duplicate')
+            if old['submitted'] > entry['submitted']:
+                continue
+        latest[entry['email']] = entry
+    yield from sorted(latest.values(), key=lambda entry: entry['submitted'])
+
+# Rules for leaving students out: exact emails, whole domains ('*@example.edu' or '@example.edu') and every
+# subdomain of a domain ('*@*.example.edu'). Every lookup is a hash set lookup.
+class ExcludeRules:
+    def __init__(self, emails=(), domains=(), subdomains=()):
+        self.emails = set(emails)
+        self.domains = set(domains)
+        self.subdomains = set(subdomains)
+
+    def __len__(self):
+        return len(self.emails) + len(self.domains) + len(self.subdomains)
+
+    def excludes(self, email):
+        if email in self.emails:
+            return True
+        labels = email.rsplit('@', 1)[-1].split('.')
+        if '.'.join(labels) in self.domains:
+            return True
+        return any('.'.join(labels[i:]) in self.subdomains for i in range(1, len(labels)))
+
+# Parses the lines of an exclude file into ExcludeRules. Blank lines and lines starting with # are skipped.
+# Returns the rules and the lines that are neither an email nor a domain rule.
+def parseExcludeRules(lines):
+    rules, invalid = ExcludeRules(), []
+    for line in lines:
+        rule = normalizeEmail(line)
+        if rule == '' or rule.startswith('#'):
+            continue
+        if EMAIL.match(rule):
+            rules.emails.add(rule)
+        elif DOMAIN.match(rule):
+            domain = rule.split('@', 1)[1]
+            if domain.startswith('*.'):
+                rules.subdomains.add(domain[2:])
+            else:
+                rules.domains.add(domain)
+        else:
+            invalid.append(line)
+    return rules, invalid
+
+# Drops students who opted out or match the exclude rules
+def filterEntries(entries, rules, drops):
+    for entry in entries:
+        if entry['optedOut']:
+            _drop(drops, 'opted_out')
+        elif rules.excludes(entry['email']):
+            _drop(drops, 'excluded')
+        else:
+            yield entry
+
+# Runs every stage of the pipeline over the responses. Returns the entries of the students to group and the number
+# of responses each stage dropped.
+def buildRoster(responses, ids, rules=None):
+    drops = {}
+    entries = parseResponses(responses, ids, drops)
+    entries = normalizeEntries(entries, drops)
+    entries = latestPerEmail(entries, drops)
+    entries = filterEntries(entries, rules or ExcludeRules(), drops)
+    return list(entries), drops
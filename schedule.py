@@ -0,0 +1,118 @@
+import json
+import os
+import random
+
+from matching import maxMatching
+from utils import atomicWrite
+
+SCHEDULE_DIR = 'schedules'
+
+# A schedule is a full season of rounds of pairs in which no pair repeats, stored with the roster it was made
+# for and a cursor to the next round:
+# {"roster": [emails], "cursor": 0, "rounds": [{"pairs": [[email, email], ...], "bye": email or null}, ...]}
+
+def scheduleFile(sheetId, directory=SCHEDULE_DIR):
+    return os.path.join(directory, '{}.json'.format(sheetId))
+
+def loadSchedule(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def saveSchedule(path, schedule):
+    atomicWrite(path, lambda f: json.dump(schedule, f))
+
+# Builds a season of len(emails) - 1 rounds (len(emails) if odd) with the circle method, so that every pair meets
+# exactly once. timesMet(a, b) returns how many times two students have been grouped before, and rounds with the
+# fewest previous meetings are put first.
+def buildSchedule(emails, timesMet, seed=None):
+    players = list(emails)
+    random.Random(seed).shuffle(players)
+    if len(players) % 2 == 1:
+        players.append(None)
+    n = len(players)
+
+    rounds = []
+    for r in range(n - 1):
+        pairs, bye = [], None
+        for i in range(n // 2):
+            a, b = players[i], players[n - 1 - i]
+            if a is None or b is None:
+                bye = a if b is None else b
+            else:
+                pairs.append([a, b])
+        rounds.append({'pairs': pairs, 'bye': bye})
+        # Keep the first player fixed and rotate everyone else one place
+        players = [players[0], players[-1]] + players[1:-1]
+
+    rounds.sort(key=lambda rnd: sum(timesMet(a, b) for a, b in rnd['pairs']))
+    return {'roster': list(emails), 'cursor': 0, 'rounds': rounds}
+
+# Updates the remaining rounds of the schedule for students who left or joined since it was made. Only the
+# partners of students who left, the students who joined, and each round's bye are re-paired, preferring pairs
+# that appear nowhere else in the remaining rounds and have never been grouped before.
+# Returns the number of rounds that changed.
+def updateSchedule(schedule, emails, timesMet):
+    current, roster = set(emails), set(schedule['roster'])
+    removed, added = roster - current, [email for email in emails if email not in roster]
+    if len(removed) == 0 and len(added) == 0:
+        return 0
+
+    remaining = schedule['rounds'][schedule['cursor']:]
+    used = set()
+    for rnd in remaining:
+        for a, b in rnd['pairs']:
+            if a not in removed and b not in removed:
+                used.add(frozenset((a, b)))
+
+    changed = 0
+    for rnd in remaining:
+        unpaired = list(added)
+        if rnd['bye'] is not None and rnd['bye'] not in removed:
+            unpaired.append(rnd['bye'])
+        pairs = []
+        for a, b in rnd['pairs']:
+            if a in removed and b not in removed:
+                unpaired.append(b)
+            elif b in removed and a not in removed:
+                unpaired.append(a)
+            elif a not in removed:
+                pairs.append([a, b])
+        if len(pairs) == len(rnd['pairs']) and len(unpaired) == (rnd['bye'] is not None):
+            continue
+
+        # Match the unpaired students among themselves on pairs that are new to both the season and the history
+        def neighbors(i):
+            return [j for j in range(len(unpaired)) if j != i and frozenset((unpaired[i], unpaired[j])) not in used
+                    and timesMet(unpaired[i], unpaired[j]) == 0]
+        match = maxMatching(len(unpaired), neighbors)
+        leftover = [unpaired[i] for i, j in enumerate(match) if j == -1]
+        newPairs = [[unpaired[i], unpaired[j]] for i, j in enumerate(match) if i < j]
+        # Anyone left has to repeat a pair, so give them their least met partners
+        leftover.sort()
+        while len(leftover) > 1:
+            a = leftover.pop()
+            b = min(leftover, key=lambda other: (frozenset((a, other)) in used, timesMet(a, other)))
+            leftover.remove(b)
+            newPairs.append([a, b])
+        for a, b in newPairs:
+            used.add(frozenset((a, b)))
+
+        rnd['pairs'] = pairs + newPairs
+        rnd['bye'] = leftover[0] if leftover else None
+        changed += 1
+
+    schedule['roster'] = list(emails)
+    return changed
+
+def roundsLeft(schedule):
+    return len(schedule['rounds']) - schedule['cursor']
+
+# Returns the pairs and the bye (or None) of the next round
+def nextRound(schedule):
+    rnd = schedule['rounds'][schedule['cursor']]
+    return rnd['pairs'], rnd['bye']
+
+def advance(schedule):
+    schedule['cursor'] += 1
@@ -0,0 +1,60 @@
+import hashlib
+import os
+import threading
+import time
+
+import httplib2
+from apiclient import discovery
+from googleapiclient.discovery_cache.base import Cache
+from googleapiclient.version import __version__ as CLIENT_VERSION
+
+import metrics
+from utils import atomicWrite
+
+DISCOVERY_CACHE_DIR     = 'discovery_cache'
+DISCOVERY_CACHE_VERSION = 1             # bump to throw away every cached discovery document
+DISCOVERY_MAX_AGE       = 7 * 24 * 3600 # seconds
+HTTP_TIMEOUT            = 60            # seconds
+
+# Discovery documents cached on disk, one file per discovery URL. Documents are kept in a directory named after
+# the cache and client library versions, so upgrading either never reads a stale document.
+class DiscoveryCache(Cache):
+    def __init__(self, directory=DISCOVERY_CACHE_DIR, maxAge=DISCOVERY_MAX_AGE):
+        self.directory = os.path.join(directory, 'v{}-{}'.format(DISCOVERY_CACHE_VERSION, CLIENT_VERSION))
+        self.maxAge = maxAge
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def get(self, url):
+        path = self.path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self.maxAge:
+                return None
+            with open(path, 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        atomicWrite(self.path(url), lambda f: f.write(content))
+
+# Every thread gets its own authorized HTTP transport and clients, since httplib2 connections can't be shared
+# between threads. Within a thread, one keep-alive transport is reused by every client for the whole run.
+_local = threading.local()
+_cache = DiscoveryCache()
+
+def getHttp(credentials):
+    transports = _local.__dict__.setdefault('transports', {})
+    if id(credentials) not in transports:
+        transports[id(credentials)] = credentials.authorize(httplib2.Http(timeout=HTTP_TIMEOUT))
+    return transports[id(credentials)]
+
+# Returns the client for the API, building it the first time it is asked for in this thread
+def getService(name, version, credentials, **kwargs):
+    services = _local.__dict__.setdefault('services', {})
+    key = (name, version, id(credentials), tuple(sorted(kwargs.items())))
+    if key not in services:
+        with metrics.api('discovery.build.{}'.format(name)):
+            services[key] = discovery.build(name, version, http=getHttp(credentials), cache=_cache, **kwargs)
+    return services[key]
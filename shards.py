@@ -0,0 +1,102 @@
+import hashlib
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from history import PairIndex
+from matching import maxMatching, localSearchGroups
+
+SHARD_BY = ['random', 'hash', 'college']
+
+# Splits students (by position) into `shards` shards of about the same size. 'random' deals shuffled students out
+# in turn, 'hash' puts each student in the shard given by a hash of their email (so the same students share a
+# shard every run), and 'college' keeps each college in one shard, filling the smallest shard with the largest
+# college first. Returns a list with the shard of each student.
+def partition(students, shards, by='random', seed=None):
+    if by == 'hash':
+        return [int(hashlib.md5(student.email.strip().casefold().encode()).hexdigest(), 16) % shards for student in students]
+    if by == 'college':
+        colleges = defaultdict(list)
+        for i, student in enumerate(students):
+            colleges[student.college].append(i)
+        shardOf, sizes = [0] * len(students), [0] * shards
+        for members in sorted(colleges.values(), key=len, reverse=True):
+            shard = sizes.index(min(sizes))
+            sizes[shard] += len(members)
+            for i in members:
+                shardOf[i] = shard
+        return shardOf
+    order = list(range(len(students)))
+    random.Random(seed).shuffle(order)
+    shardOf = [0] * len(students)
+    for position, i in enumerate(order):
+        shardOf[i] = position % shards
+    return shardOf
+
+# Slices the pairs that have met before out of the pair index (a PairIndex or SparsePairIndex) into the pairs inside
+# each shard. Returns the members of each shard and, per shard, arrays of (i, j, times) in the shard's own numbering.
+def sliceHistory(shardOf, shards, pairIndex):
+    shardOf = np.asarray(shardOf, dtype=np.int64)
+    members = [np.flatnonzero(shardOf == shard) for shard in range(shards)]
+    local = np.zeros(len(shardOf), dtype=np.int64)
+    for shard in range(shards):
+        local[members[shard]] = np.arange(len(members[shard]))
+
+    i, j, times = pairIndex.pairs()
+    inside = shardOf[i] == shardOf[j]
+    i, j, times, shard = i[inside], j[inside], times[inside], shardOf[i[inside]]
+    pairs = [np.stack([local[i[shard == s]], local[j[shard == s]], times[shard == s]], axis=1) for s in range(shards)]
+    return [m.tolist() for m in members], pairs
+
+# Groups one shard of n students given the pairs in it that have met before. Runs in a worker process.
+# Returns the groups in which every pair is new, and the students left over (unmatched or in a group with a repeat).
+def matchShard(n, pairs, groupSize, timeBudget):
+    index = PairIndex(n)
+    for i, j, times in pairs.tolist():
+        index.add(i, j, times)
+    if groupSize == 2:
+        match = maxMatching(n, index.newPartners)
+        return [[i, j] for i, j in enumerate(match) if i < j], [i for i, j in enumerate(match) if j == -1]
+    if n < groupSize:
+        return [], list(range(n))
+    idGroups, _, _ = localSearchGroups(n, groupSize, index.count, timeBudget)
+    groups = [grp for grp in idGroups if index.isNewGroup(grp)]
+    leftover = [i for grp in idGroups if not index.isNewGroup(grp) for i in grp]
+    return groups, leftover
+
+# Groups the students in `shards` shards in parallel worker processes, then groups the students every shard left
+# over in one final pass against the whole pairIndex. A SparsePairIndex keeps the parent process proportional to the
+# history rather than to n * n. Returns the groups as lists of student ids.
+def shardedGroups(students, pairIndex, groupSize, shards, by='random', timeBudget=5.0, workers=None, seed=None):
+    shardOf = partition(students, shards, by, seed)
+    members, pairs = sliceHistory(shardOf, shards, pairIndex)
+
+    groups, leftover = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(matchShard, len(members[s]), pairs[s], groupSize, timeBudget) for s in range(shards)]
+        for s, future in enumerate(futures):
+            shardGroups, shardLeftover = future.result()
+            groups.extend([[members[s][i] for i in grp] for grp in shardGroups])
+            leftover.extend([members[s][i] for i in shardLeftover])
+
+    # Fix up the leftovers of every shard together
+    n = len(leftover)
+    if groupSize == 2:
+        match = maxMatching(n, lambda i: [j for j in range(n) if j != i and pairIndex.isNew(leftover[i], leftover[j])])
+        groups.extend([[leftover[i], leftover[j]] for i, j in enumerate(match) if i < j])
+        rest = [leftover[i] for i, j in enumerate(match) if j == -1]
+        groups.extend([rest[i:i + 2] for i in range(0, len(rest) - 1, 2)])
+        if len(rest) % 2 == 1:
+            groups.append([rest[-1]])
+    elif n >= max(2, groupSize - 1):
+        idGroups, _, _ = localSearchGroups(n, groupSize, lambda i, j: pairIndex.count(leftover[i], leftover[j]), timeBudget)
+        groups.extend([[leftover[i] for i in grp] for grp in idGroups])
+    else:
+        # Too few to make a group of their own, so spread them over the groups found so far
+        for k, i in enumerate(leftover):
+            if len(groups) == 0:
+                groups.append([])
+            groups[k % len(groups)].append(i)
+    return groups
@@ -0,0 +1,208 @@
+import re
+import sqlite3
+from itertools import combinations
+
+import metrics
+
+GROUPS_DB = 'groups.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sync (
+    sheet_id    TEXT PRIMARY KEY,
+    row_count   INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS generations (
+    sheet_id    TEXT PRIMARY KEY,
+    generation  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS groupings (
+    sheet_id    TEXT NOT NULL,
+    row         INTEGER NOT NULL,
+    week        TEXT NOT NULL,
+    PRIMARY KEY (sheet_id, row)
+);
+CREATE TABLE IF NOT EXISTS members (
+    sheet_id    TEXT NOT NULL,
+    row         INTEGER NOT NULL,
+    position    INTEGER NOT NULL,
+    name        TEXT NOT NULL,
+    email       TEXT NOT NULL,
+    PRIMARY KEY (sheet_id, row, position)
+);
+CREATE INDEX IF NOT EXISTS members_email ON members (sheet_id, email);
+CREATE TABLE IF NOT EXISTS pairs (
+    sheet_id    TEXT NOT NULL,
+    row         INTEGER NOT NULL,
+    a_name      TEXT NOT NULL,
+    a_email     TEXT NOT NULL,
+    b_name      TEXT NOT NULL,
+    b_email     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pairs_members ON pairs (sheet_id, a_email, b_email, a_name, b_name);
+CREATE INDEX IF NOT EXISTS pairs_b_email ON pairs (sheet_id, b_email);
+CREATE INDEX IF NOT EXISTS pairs_b_name ON pairs (sheet_id, b_name) WHERE b_email = '';
+'''
+
+# Local SQLite mirror of the groups sheet. Rows are only ever appended to the sheet, so syncing downloads just
+# the rows after the last known row count. Rows are stored split into members and pairs so that the matcher
+# never has to parse the sheet's strings again.
+class GroupStore:
+    def __init__(self, path=GROUPS_DB):
+        # Cohorts run in parallel processes can share the database, so wait for their writes instead of failing.
+        # The store is synced from a startup thread and used from the main thread afterwards, never at once.
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def rowCount(self, sheetId):
+        row = self.db.execute('SELECT row_count FROM sync WHERE sheet_id = ?', (sheetId,)).fetchone()
+        return row[0] if row else 0
+
+    # Returns a number that changes whenever rows already in the store are forgotten or replaced, so that anything
+    # derived from them (like the analytics cache) can tell that it is out of date. Appending rows keeps it the same.
+    def generation(self, sheetId):
+        row = self.db.execute('SELECT generation FROM generations WHERE sheet_id = ?', (sheetId,)).fetchone()
+        return row[0] if row else 0
+
+    def _bumpGeneration(self, sheetId):
+        self.db.execute('INSERT INTO generations VALUES (?, 1) ON CONFLICT (sheet_id) DO UPDATE SET generation = generation + 1',
+                        (sheetId,))
+
+    # Forgets everything mirrored from the sheet, so that the next sync downloads every row again
+    def reset(self, sheetId):
+        with self.db:
+            for table in ('sync', 'groupings', 'members', 'pairs'):
+                self.db.execute('DELETE FROM {} WHERE sheet_id = ?'.format(table), (sheetId,))
+            self._bumpGeneration(sheetId)
+
+    # Records values (rows of [week, names, emails] as in the sheet) starting at sheet row firstRow, replacing
+    # anything recorded for those rows before
+    def insert(self, sheetId, firstRow, values):
+        lastRow = firstRow + len(values) - 1
+        with self.db:
+            # Rows past the last known row are new, so only a range the store has seen needs clearing
+            if firstRow <= self.rowCount(sheetId) + 1:
+                replaced = self.db.execute('DELETE FROM groupings WHERE sheet_id = ? AND row BETWEEN ? AND ?', (sheetId, firstRow, lastRow)).rowcount
+                for table in ('members', 'pairs'):
+                    self.db.execute('DELETE FROM {} WHERE sheet_id = ? AND row BETWEEN ? AND ?'.format(table), (sheetId, firstRow, lastRow))
+                if replaced > 0:
+                    self._bumpGeneration(sheetId)
+            for offset, row in enumerate(values):
+                rowNum = firstRow + offset
+                if len(row) < 2 or not row[1]:
+                    continue
+                names = row[1].split(', ')
+                emails = row[2].split(', ') if len(row) > 2 and row[2] else []
+                if len(emails) != len(names):
+                    emails = [''] * len(names)
+                emails = [email.strip().casefold() for email in emails]
+                self.db.execute('INSERT OR REPLACE INTO groupings VALUES (?, ?, ?)', (sheetId, rowNum, row[0]))
+                self.db.executemany('INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)',
+                                    [(sheetId, rowNum, i, name, email) for i, (name, email) in enumerate(zip(names, emails))])
+                self.db.executemany('INSERT INTO pairs VALUES (?, ?, ?, ?, ?, ?)',
+                                    [(sheetId, rowNum) + a + b for a, b in combinations(sorted(zip(names, emails), key=lambda m: (m[1], m[0])), 2)])
+            self.db.execute('INSERT INTO sync VALUES (?, ?) ON CONFLICT (sheet_id) DO UPDATE SET row_count = max(row_count, excluded.row_count)',
+                            (sheetId, lastRow - 1))
+
+    # Downloads the sheet rows after the last known row count, up to lastRow if given. Returns the number of new rows.
+    def sync(self, sheet, sheetId, lastRow=None):
+        firstRow = self.rowCount(sheetId) + 2
+        with metrics.api('sheets.values.get'):
+            result = sheet.values().get(spreadsheetId=sheetId, range='Sheet1!A{}:C{}'.format(firstRow, lastRow or '')).execute()
+        values = result.get('values', [])
+        if len(values) > 0:
+            self.insert(sheetId, firstRow, values)
+        return len(values)
+
+    # Appends values to the end of the sheet in one call and mirrors them locally at the rows the sheet reports.
+    # Rows added to the sheet by someone else since the last sync are downloaded first, so that none are skipped.
+    # Returns the number of those rows.
+    def append(self, sheet, sheetId, values):
+        with metrics.api('sheets.values.append'):
+            result = sheet.values().append(spreadsheetId=sheetId, range='Sheet1!A:C', valueInputOption='USER_ENTERED',
+                                           insertDataOption='INSERT_ROWS', body={'values': values}).execute()
+        firstRow = int(re.search(r'![A-Z]+(\d+)', result['updates']['updatedRange']).group(1))
+        numGap = 0
+        if firstRow > self.rowCount(sheetId) + 2:
+            numGap = self.sync(sheet, sheetId, firstRow - 1)
+        self.insert(sheetId, firstRow, values)
+        return numGap
+
+    # Overwrites sheet row rowNum with values (one row of [week, names, emails]) and mirrors it locally
+    def update(self, sheet, sheetId, rowNum, values):
+        with metrics.api('sheets.values.update'):
+            sheet.values().update(spreadsheetId=sheetId, range='Sheet1!A{0}:C{0}'.format(rowNum), valueInputOption='USER_ENTERED',
+                                  body={'values': [values]}).execute()
+        self.insert(sheetId, rowNum, [values])
+
+    # Returns the sheet row of every grouping saved for week, keyed on the emails of its members in order
+    def rowsOfWeek(self, sheetId, week):
+        members = {}
+        for rowNum, email in self.db.execute('''SELECT g.row, m.email FROM groupings g
+                                                JOIN members m ON m.sheet_id = g.sheet_id AND m.row = g.row
+                                                WHERE g.sheet_id = ? AND g.week = ? ORDER BY g.row, m.position''', (sheetId, week)):
+            members.setdefault(rowNum, []).append(email)
+        return {tuple(emails): rowNum for rowNum, emails in members.items()}
+
+    # Returns every grouping as [week, names of students in group, emails of students in group], as getPrevGroups does
+    def rows(self, sheetId):
+        rows, current = [], None
+        for rowNum, week, name, email in self.db.execute('''SELECT g.row, g.week, m.name, m.email FROM groupings g
+                                                            JOIN members m ON m.sheet_id = g.sheet_id AND m.row = g.row
+                                                            WHERE g.sheet_id = ? ORDER BY g.row, m.position''', (sheetId,)):
+            if rowNum != current:
+                current = rowNum
+                rows.append([week, [], []])
+            rows[-1][1].append(name)
+            rows[-1][2].append(email)
+        return [[week, tuple(names), tuple(emails) if all(emails) else ()] for week, names, emails in rows]
+
+    # Returns (name a, email a, name b, email b, times grouped) for every pair that has been grouped together
+    def pairCounts(self, sheetId):
+        return self.db.execute('''SELECT a_name, a_email, b_name, b_email, COUNT(*) FROM pairs WHERE sheet_id = ?
+                                  GROUP BY a_email, b_email, a_name, b_name''', (sheetId,)).fetchall()
+
+    # Returns how many times the student with email has been grouped with each of their past partners, as
+    # {email: times}. Old rows saved without emails are matched on name instead, if given, and their partners are
+    # keyed 'name:' and their name. Only reads the student's own rows, through the email and name indexes.
+    def partnerCounts(self, sheetId, email, name=None):
+        return dict(self.db.execute('''SELECT partner, SUM(times) FROM (
+                                         SELECT b_email AS partner, COUNT(*) AS times FROM pairs WHERE sheet_id = ? AND a_email = ? GROUP BY b_email
+                                         UNION ALL
+                                         SELECT a_email, COUNT(*) FROM pairs WHERE sheet_id = ? AND b_email = ? GROUP BY a_email
+                                         UNION ALL
+                                         SELECT 'name:' || b_name, COUNT(*) FROM pairs WHERE sheet_id = ? AND a_email = '' AND b_email = '' AND a_name = ? GROUP BY b_name
+                                         UNION ALL
+                                         SELECT 'name:' || a_name, COUNT(*) FROM pairs INDEXED BY pairs_b_name WHERE sheet_id = ? AND b_email = '' AND b_name = ? GROUP BY a_name)
+                                       GROUP BY partner''', (sheetId, email, sheetId, email, sheetId, name, sheetId, name)).fetchall())
+
+    # Returns how many times the students with emails a and b have been grouped together, counting old rows saved
+    # without emails by nameA and nameB if given, with one index lookup each
+    def pairTimes(self, sheetId, a, b, nameA=None, nameB=None):
+        a, b = sorted((a, b))
+        if nameA is None or nameB is None:
+            nameA = nameB = None
+        else:
+            nameA, nameB = sorted((nameA, nameB))
+        return self.db.execute('''SELECT (SELECT COUNT(*) FROM pairs WHERE sheet_id = ? AND a_email = ? AND b_email = ?) +
+                                         (SELECT COUNT(*) FROM pairs WHERE sheet_id = ? AND a_email = '' AND b_email = '' AND a_name = ? AND b_name = ?)''',
+                               (sheetId, a, b, sheetId, nameA, nameB)).fetchone()[0]
+
+    # Returns (row, key) for every member of every grouping after afterRow and (row, week) for those groupings, both in
+    # sheet order. The key is the member's email, or 'name:' and their name for old rows saved without emails. Each is
+    # read straight off its primary key with no join.
+    def members(self, sheetId, afterRow=0):
+        members = self.db.execute('''SELECT row, CASE WHEN email != '' THEN email ELSE 'name:' || name END FROM members
+                                     WHERE sheet_id = ? AND row > ? ORDER BY row, position''', (sheetId, afterRow)).fetchall()
+        weeks = self.db.execute('SELECT row, week FROM groupings WHERE sheet_id = ? AND row > ? ORDER BY row', (sheetId, afterRow)).fetchall()
+        return members, weeks
+
+    # Returns the number of groupings up to and including row
+    def groupingsUpTo(self, sheetId, row):
+        return self.db.execute('SELECT COUNT(*) FROM groupings WHERE sheet_id = ? AND row <= ?', (sheetId, row)).fetchone()[0]
+
+    # Returns {email: name} for the members of every grouping from row on
+    def namesSince(self, sheetId, row):
+        return dict(self.db.execute('SELECT email, name FROM members WHERE sheet_id = ? AND row >= ? ORDER BY row', (sheetId, row)).fetchall())
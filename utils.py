@@ -1,4 +1,6 @@
 import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Convert string to boolean
 def str2bool(v):
@@ -9,4 +11,31 @@ def str2bool(v):
     elif v.lower() in ('no', 'false', 'f', 'n', '0'):
         return False
     else:
-        raise argparse.ArgumentTypeError('Boolean value expected.')
\ No newline at end of file
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+# Writes path by calling write(f) on a temporary file next to it and then moving that over path, so that an
+# interrupted run never leaves a truncated file behind and a parallel run never reads a half-written one. With sync,
+# the data is on disk before the move, so the file survives a crash of the machine too.
+def atomicWrite(path, write, binary=False, sync=False):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb' if binary else 'w') as f:
+        write(f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# Runs every task in tasks ({name: (function, args)}) in its own thread and waits for all of them, so that
+# independent I/O takes as long as the slowest task instead of the sum of them.
+# Returns the results and the exceptions raised, each keyed by task name.
+def runConcurrently(tasks):
+    results, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, len(tasks))) as pool:
+        futures = {pool.submit(function, *args): name for name, (function, args) in tasks.items()}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:
+                failures[futures[future]] = error
+    return results, failures